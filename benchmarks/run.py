@@ -0,0 +1,234 @@
+"""
+Benchmarks of the hot paths of verolysis
+
+Run from the repository root:
+
+    PYTHONPATH=src python benchmarks/run.py [--quick] [--save results.json]
+        [--compare baseline.json] [--threshold 1.25] [-k pattern]
+
+Each benchmark is timed at several sizes, in segments or bracket rows, and
+reported together with its log-log scaling exponent. Results can be saved as
+JSON and compared against an earlier run; the exit status is 1 if any
+benchmark got slower than the threshold ratio.
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import timeit
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import scipy
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+import synthetic  # noqa: E402
+from verolysis import income_brackets  # noqa: E402
+from verolysis.piecewise_density import PiecewiseDensity  # noqa: E402
+from verolysis.piecewise_density_optimizer import (  # noqa: E402
+    PiecewiseDensityOptimizer,
+)
+
+BENCHMARKS: dict[str, tuple[list[int], list[int], Callable]] = {}
+
+
+def benchmark(sizes: list[int], quick: list[int]):
+    """
+    Register a benchmark
+
+    The function takes a size and returns the callable to time, so that any
+    setup is left out of the timing.
+    """
+
+    def register(setup: Callable[[int], Callable[[], object]]):
+        BENCHMARKS[setup.__name__] = (sizes, quick, setup)
+        return setup
+
+    return register
+
+
+@benchmark(sizes=[1_000, 10_000, 100_000, 1_000_000], quick=[1_000, 10_000])
+def merge(segments: int):
+    parts = synthetic.make_parts(segments, 10)
+    return lambda: PiecewiseDensity.merge(parts)
+
+
+@benchmark(sizes=[1_000, 10_000, 100_000], quick=[1_000, 10_000])
+def add(segments: int):
+    parts = synthetic.make_parts(segments, 100)
+
+    def run():
+        f = PiecewiseDensity()
+        for part in parts:
+            f.add(part)
+
+    return run
+
+
+@benchmark(sizes=[1_000, 10_000, 100_000, 1_000_000], quick=[1_000, 10_000])
+def count(segments: int):
+    f = synthetic.make_density(segments)
+    a = np.random.default_rng(1).uniform(0, 1e6, 10_000)
+    f.count()
+    return lambda: f.count_many(a, a + 1_000)
+
+
+@benchmark(sizes=[1_000, 10_000, 100_000, 1_000_000], quick=[1_000, 10_000])
+def icount(segments: int):
+    f = synthetic.make_density(segments)
+    n = np.random.default_rng(1).uniform(0, f.count(), 10_000)
+    return lambda: f.icount_many(n)
+
+
+@benchmark(sizes=[1_000, 10_000, 100_000, 1_000_000], quick=[1_000, 10_000])
+def uniform_sample(segments: int):
+    f = synthetic.make_density(segments)
+    f.count()
+    return lambda: f.uniform_sample(1_000_000)
+
+
+@benchmark(sizes=[3, 11], quick=[3, 11])
+def optimize(fractiles: int):
+    row = synthetic.make_table(1).iloc[0]
+    keys = [key for key, _ in income_brackets._FRAC_KEYS]
+    if fractiles < len(keys):
+        keys = ["Q1", "P50", "Q3"]
+    fracs = dict(income_brackets._FRAC_KEYS)
+
+    def run():
+        opt = PiecewiseDensityOptimizer(row.N, row.Mean, 0.0)
+        for key in keys:
+            opt.add(row[key], fracs[key])
+        opt.optimize()
+        return opt.build()
+
+    return run
+
+
+@benchmark(sizes=[50, 200, 1_000], quick=[50])
+def to_density(rows: int):
+    table = synthetic.make_table(rows)
+    return lambda: income_brackets.to_density(table)
+
+
+@benchmark(sizes=[50, 200, 1_000, 5_000], quick=[50, 200])
+def to_density_batch(rows: int):
+    table = synthetic.make_table(rows)
+    return lambda: income_brackets.to_density(table, batch=True)
+
+
+@benchmark(sizes=[50, 200, 1_000], quick=[50])
+def to_density_bunched(rows: int):
+    table = synthetic.make_table(rows, bunched=rows // 10)
+    return lambda: income_brackets.to_density(table)
+
+
+@benchmark(sizes=[50, 200, 1_000, 5_000], quick=[50, 200])
+def to_density_batch_bunched(rows: int):
+    table = synthetic.make_table(rows, bunched=rows // 10)
+    return lambda: income_brackets.to_density(table, batch=True)
+
+
+def measure(fn: Callable, min_time: float) -> float:
+    """Best time per call, in seconds, over repeated runs"""
+    timer = timeit.Timer(fn)
+    number, total = timer.autorange()
+    repeat = max(1, min(5, int(min_time / max(total, 1e-9))))
+    times = [total] + timer.repeat(repeat=repeat, number=number)
+    return min(times) / number
+
+
+def slope(sizes: list[int], times: list[float]) -> float:
+    """Exponent k of the best fit time ~ size**k"""
+    if len(sizes) < 2:
+        return float("nan")
+    return float(np.polyfit(np.log(sizes), np.log(times), 1)[0])
+
+
+def run(names: list[str], quick: bool, min_time: float) -> dict:
+    results = {}
+    for name in names:
+        sizes, quick_sizes, setup = BENCHMARKS[name]
+        sizes = quick_sizes if quick else sizes
+        results[name] = {}
+        for size in sizes:
+            results[name][str(size)] = measure(setup(size), min_time)
+            print(f"{name:>24} {size:>10} {_ms(results[name][str(size)])}")
+        times = list(results[name].values())
+        print(f"{name:>24} {'scaling':>10} {slope(sizes, times):9.2f}")
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Print the ratio of each time to the baseline, returning regressions"""
+    regressions = []
+    print(f"\n{'':>24} {'size':>10} {'baseline':>12} {'now':>12} {'ratio':>7}")
+    for name, times in results.items():
+        for size, t in times.items():
+            t0 = baseline.get(name, {}).get(size)
+            if t0 is None:
+                continue
+            ratio = t / t0
+            mark = " <-" if ratio > threshold else ""
+            print(f"{name:>24} {size:>10} {_ms(t0)} {_ms(t)} {ratio:7.2f}{mark}")
+            if ratio > threshold:
+                regressions.append(f"{name}[{size}]")
+    return regressions
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "machine": platform.machine(),
+    }
+
+
+def _ms(t: float) -> str:
+    return f"{t * 1e3:9.3f} ms"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--quick", action="store_true", help="small sizes only")
+    parser.add_argument("--save", type=Path, help="write the results as JSON")
+    parser.add_argument("--compare", type=Path, help="JSON results to compare to")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    parser.add_argument("--min-time", type=float, default=1.0)
+    parser.add_argument("-k", default="", help="run benchmarks matching this")
+    args = parser.parse_args(argv)
+
+    names = [name for name in BENCHMARKS if args.k in name]
+    results = run(names, args.quick, args.min_time)
+    if args.save is not None:
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        data = {"meta": metadata(), "results": results}
+        args.save.write_text(json.dumps(data, indent=2))
+    if args.compare is not None:
+        baseline = json.loads(args.compare.read_text())["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nSlower than {args.threshold}x: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
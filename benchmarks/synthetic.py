@@ -0,0 +1,70 @@
+"""Synthetic inputs for the benchmarks, generated offline"""
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from verolysis import income_brackets
+from verolysis.piecewise_density import PiecewiseDensity
+
+
+# Fractiles and mean of test_case_c over its P90, which bunch its left fringe
+_BUNCHED = {
+    "Q1": 20_128,
+    "Q3": 27_894,
+    "P10": 7_535,
+    "P20": 17_195,
+    "P30": 22_436,
+    "P40": 24_898,
+    "P50": 25_832,
+    "P60": 26_683,
+    "P70": 27_498,
+    "P80": 28_284,
+    "P90": 29_076,
+    "Mean": 22_398,
+}
+
+
+def make_table(rows: int, seed: int = 0, bunched: int = 0) -> pd.DataFrame:
+    """
+    Income bracket table shaped like tulot_101.px
+
+    Each bracket holds a Beta(2, 2) distribution over its income range, so
+    the fractiles and the mean are exact. Every fifth row only has its
+    quartiles, as the smallest brackets do in the real table. The lowest
+    `bunched` brackets instead take the shape of test_case_c scaled to their
+    upper edge, so that their fits need the three-parameter left fringe.
+    """
+    rng = np.random.default_rng(seed)
+    edges = np.concatenate([[0.0], np.cumsum(rng.uniform(2_000, 8_000, rows))])
+    lo, hi = edges[:-1], edges[1:]
+    df = pd.DataFrame(
+        {
+            "Tulonsaajaryhmä": "Y",
+            "Tuloluokka": [str(i + 1) for i in range(rows)],
+            "N": rng.integers(1_000, 100_000, rows).astype(float),
+            "Mean": (lo + hi) / 2,
+        }
+    )
+    for key, frac in income_brackets._FRAC_KEYS:
+        df[key] = lo + (hi - lo) * stats.beta.ppf(frac, 2, 2)
+    quartiles_only = np.arange(rows) % 5 == 1
+    for key in ("P10", "P20", "P30", "P40", "P60", "P70", "P80", "P90"):
+        df.loc[quartiles_only, key] = np.nan
+    scale = hi[:bunched] / _BUNCHED["P90"]
+    for key, value in _BUNCHED.items():
+        df.loc[: bunched - 1, key] = value * scale
+    return df
+
+
+def make_density(segments: int, seed: int = 0) -> PiecewiseDensity:
+    """Density of the given number of touching segments over [0, 1e6)"""
+    rng = np.random.default_rng(seed)
+    x = np.sort(rng.uniform(0, 1e6, segments + 1))
+    n = rng.uniform(1, 1_000, segments)
+    return PiecewiseDensity.from_arrays(x[:-1], x[1:], n)
+
+
+def make_parts(segments: int, parts: int, seed: int = 0) -> list[PiecewiseDensity]:
+    """Overlapping densities with the given number of segments in total"""
+    return [make_density(segments // parts, seed + i) for i in range(parts)]
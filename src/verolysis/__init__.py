@@ -1,6 +1,13 @@
 from verolysis.piecewise_density import PiecewiseDensity
 from verolysis.piecewise_density_builder import PiecewiseDensityBuilder
 from verolysis.piecewise_density_optimizer import PiecewiseDensityOptimizer
+from verolysis.piecewise_density_batch_optimizer import (
+    PiecewiseDensityBatchOptimizer,
+)
+from verolysis.keyed_density import KeyedDensity
+from verolysis.lazy_density import LazyDensity
+from verolysis.density_cache import DensityCache
 from verolysis import data
 from verolysis import income_brackets
+from verolysis import instrument
 from verolysis import plot
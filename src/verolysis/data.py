@@ -1,24 +1,174 @@
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Iterable
+
 import pandas as pd
 import statfin
 
 
+class OfflineError(LookupError):
+    """A table was needed from the network while in offline mode"""
+
+
+class Store:
+    """
+    Local columnar copy of queried tables
+
+    Each (year, Erä) table is kept as one Parquet file, with Tulonsaajaryhmä
+    and Tuloluokka as categorical columns and an integer Verovuosi, however
+    the table was fetched. Reads filter by group in the Parquet reader, so
+    only the matching rows are loaded.
+    """
+
+    def __init__(self, path: str | os.PathLike):
+        self._path = Path(path)
+
+    def path(self, part: str, year: int) -> Path:
+        return self._path / f"tulot_101.{year}.{part}.parquet"
+
+    def has(self, part: str, year: int) -> bool:
+        return self.path(part, year).exists()
+
+    def read(self, part: str, year: int, group=None) -> pd.DataFrame:
+        """Read a table, optionally only one group or a list of groups"""
+        filters: list[tuple[str, str, Any]] | None
+        if group is None:
+            filters = None
+        elif isinstance(group, (list, tuple, set)):
+            filters = [("Tulonsaajaryhmä", "in", [str(g) for g in group])]
+        else:
+            filters = [("Tulonsaajaryhmä", "==", str(group))]
+        return pd.read_parquet(self.path(part, year), filters=filters)
+
+    def write(self, part: str, year: int, df: pd.DataFrame) -> None:
+        path = self.path(part, year)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        df = df.astype(
+            {"Verovuosi": int, "Tulonsaajaryhmä": "category", "Tuloluokka": "category"}
+        )
+        tmp = path.with_suffix(".tmp")
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+
+
+_store: Store | None = None
+_offline: bool = False
+
+
+def configure(
+    store: Store | str | os.PathLike | None = None, offline: bool = False
+) -> None:
+    """
+    Set up the local store used by all queries
+
+    In offline mode, tables missing from the store raise OfflineError
+    instead of being fetched.
+    """
+    global _store, _offline
+    if store is not None and not isinstance(store, Store):
+        store = Store(store)
+    assert store is not None or not offline, "offline mode needs a store"
+    _store = store
+    _offline = offline
+
+
+ANSIOTULOT = "HVT_TULOT_70"
+PALKKATULOT = "HVT_TULOT_80"
+
+
+def load(
+    years: Iterable[int],
+    parts: Iterable[str] = (ANSIOTULOT, PALKKATULOT),
+    groups: Iterable | None = None,
+    years_per_query: int = 5,
+    workers: int = 4,
+) -> pd.DataFrame:
+    """
+    Several years and parts as one table
+
+    Tables already in the store are read from it. The rest are fetched with
+    one query per years_per_query years, covering all parts at once, and
+    the queries run concurrently on a shared client. The result has an
+    integer Verovuosi column, and is empty if no years or parts are given.
+    """
+    years = sorted({int(year) for year in years})
+    parts = list(parts)
+    groups = None if groups is None else [str(g) for g in groups]
+
+    frames = []
+    missing = set()
+    for year in years:
+        for part in parts:
+            if _store is not None and _store.has(part, year):
+                frames.append(_store.read(part, year, groups))
+            else:
+                missing.add((year, part))
+    if missing and _offline:
+        raise OfflineError(f"tulot_101 {sorted(missing)} not in the store")
+
+    missing_years = sorted({year for year, _ in missing})
+    missing_parts = [part for part in parts if any(p == part for _, p in missing)]
+    chunks = [
+        missing_years[i : i + years_per_query]
+        for i in range(0, len(missing_years), years_per_query)
+    ]
+    # The store holds whole tables, so only filter the query without one
+    query_groups = groups if _store is None else None
+    with ThreadPoolExecutor(workers) as executor:
+        fetched = executor.map(
+            lambda chunk: _query_many(chunk, missing_parts, query_groups), chunks
+        )
+        for df in fetched:
+            if df.empty:
+                continue
+            df = df.assign(Verovuosi=df.Verovuosi.astype(int))
+            for (year, part), table in df.groupby(["Verovuosi", "Erä"]):
+                if (year, part) not in missing:
+                    continue
+                if _store is not None:
+                    _store.write(part, year, table)
+                if groups is not None:
+                    table = table[table.Tulonsaajaryhmä.isin(groups)]
+                frames.append(table)
+
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames, ignore_index=True)
+    df = df.astype({"Tulonsaajaryhmä": "category", "Tuloluokka": "category"})
+    df["Verovuosi"] = df.Verovuosi.astype(int)
+    return df.sort_values(["Verovuosi", "Erä"], kind="stable", ignore_index=True)
+
+
 def ansiotulot(year: int, group=None) -> pd.DataFrame:
-    df = _query("HVT_TULOT_70", year)
-    if group:
-        df = df[df.Tulonsaajaryhmä == str(group)]
-    return df
+    return _table(ANSIOTULOT, year, group)
 
 
 def palkkatulot(year: int, group=None) -> pd.DataFrame:
-    df = _query("HVT_TULOT_80", year)
-    if group:
-        df = df[df.Tulonsaajaryhmä == str(group)]
-    return df
+    return _table(PALKKATULOT, year, group)
+
+
+def _table(part: str, year: int, group) -> pd.DataFrame:
+    if _store is None:
+        df = _query(part, year)
+        if group:
+            df = df[df.Tulonsaajaryhmä == str(group)]
+        return df
+    if not _store.has(part, year):
+        if _offline:
+            raise OfflineError(f"tulot_101 {year} {part} is not in the store")
+        _store.write(part, year, _query(part, year))
+    return _store.read(part, year, group or None)
+
+
+@functools.cache
+def _client():
+    return statfin.PxWebAPI.Verohallinto()
 
 
 def _query(part: str, year: int) -> pd.DataFrame:
-    db = statfin.PxWebAPI.Verohallinto()
-    table = db.table("Vero", "tulot_101.px")
+    table = _client().table("Vero", "tulot_101.px")
     df = table.query(
         {
             "Verovuosi": year,
@@ -30,3 +180,16 @@ def _query(part: str, year: int) -> pd.DataFrame:
         cache=f"tulot_101.{year}.{part}",
     )
     return df
+
+
+def _query_many(years: list[int], parts: list[str], groups) -> pd.DataFrame:
+    table = _client().table("Vero", "tulot_101.px")
+    return table.query(
+        {
+            "Verovuosi": years,
+            "Tulonsaajaryhmä": "*" if groups is None else groups,
+            "Tuloluokka": "*",
+            "Tunnusluvut": "*",
+            "Erä": parts,
+        }
+    )
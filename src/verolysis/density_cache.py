@@ -0,0 +1,99 @@
+import functools
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from verolysis import piecewise_density, piecewise_density_optimizer
+from verolysis.piecewise_density import PiecewiseDensity
+
+
+class DensityCache:
+    """
+    Content-addressed on-disk cache of fitted densities
+
+    Each entry is a .npy file holding the (a, b, n) segment arrays of one
+    fitted row, named by a hash of the fit inputs and of the fitting code. The
+    total size is kept under max_bytes by evicting the least recently used
+    entries. Writes are atomic, so several processes can share one directory.
+
+    The directory is only scanned when a running estimate of its size, from
+    the last scan plus the entries written since, goes over max_bytes.
+    """
+
+    def __init__(self, path: str | os.PathLike, max_bytes: int = 256 * 2**20):
+        self._path = Path(path)
+        self._path.mkdir(parents=True, exist_ok=True)
+        self._max_bytes = max_bytes
+        self._size: int | None = None
+
+    def key(
+        self, N: float, mean: float, fracs: list[tuple[float, float]], amin: float
+    ) -> str:
+        """Cache key of a fit, given its inputs as (value, fractile) pairs"""
+        h = hashlib.sha256(_code_version().encode())
+        h.update(np.array([N, mean, amin], dtype=np.float64).tobytes())
+        h.update(np.array(fracs, dtype=np.float64).tobytes())
+        return h.hexdigest()
+
+    def get(self, key: str) -> PiecewiseDensity | None:
+        path = self._entry(key)
+        try:
+            v = np.load(path)
+        except (FileNotFoundError, ValueError, EOFError):
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another process after loading
+            return None
+        return PiecewiseDensity.from_arrays(v[0], v[1], v[2])
+
+    def put(self, key: str, f: PiecewiseDensity) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self._path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            np.save(file, np.stack([f.va, f.vb, f.vn]))
+            size = file.tell()
+        os.replace(tmp, self._entry(key))
+        if self._size is None:
+            self._evict()
+        else:
+            self._size += size
+            if self._size > self._max_bytes:
+                self._evict()
+
+    def clear(self) -> None:
+        for path in self._path.glob("*.npy"):
+            path.unlink(missing_ok=True)
+        self._size = 0
+
+    def _entry(self, key: str) -> Path:
+        return self._path / f"{key}.npy"
+
+    def _evict(self) -> None:
+        entries = []
+        for path in self._path.glob("*.npy"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self._max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+        self._size = total
+
+
+@functools.cache
+def _code_version() -> str:
+    """Hash of the source of the modules that determine a fit"""
+    h = hashlib.sha256()
+    for module in (piecewise_density, piecewise_density_optimizer):
+        assert module.__file__ is not None
+        h.update(Path(module.__file__).read_bytes())
+    return h.hexdigest()
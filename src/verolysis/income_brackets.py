@@ -1,8 +1,16 @@
+from concurrent.futures import Executor, ProcessPoolExecutor
+
 import numpy as np
 import pandas as pd
 
+from verolysis import instrument
+from verolysis.density_cache import DensityCache
 from verolysis.piecewise_density import PiecewiseDensity, Segment
+from verolysis.piecewise_density_batch_optimizer import (
+    PiecewiseDensityBatchOptimizer,
+)
 from verolysis.piecewise_density_optimizer import PiecewiseDensityOptimizer
+from verolysis.streaming_merge import Sink, StreamingMerger
 
 
 _FRAC_KEYS = (
@@ -20,31 +28,213 @@ _FRAC_KEYS = (
 )
 
 
-def to_density(df: pd.DataFrame) -> PiecewiseDensity:
-    f = PiecewiseDensity()
-    for i in range(len(df)):
-        row = df.iloc[i]
-        if row.Tuloluokka != "SS":
-            fd = row_to_density(row)
-            if fd is not None:
-                f.add(fd)
-    return f
+_FRACTILES = np.array([frac for _, frac in _FRAC_KEYS])
+
+
+def to_density(
+    table,
+    batch: bool = False,
+    workers: int | None = None,
+    executor: Executor | None = None,
+    chunk_size: int = 16,
+    cache: DensityCache | None = None,
+    warm_start: dict | None = None,
+) -> PiecewiseDensity:
+    """
+    Density of the whole table, fitted row by row
+
+    The table can be a DataFrame, a NumPy record array or an Arrow table. Its
+    N, Mean and fractile columns are read into arrays once, up front.
+
+    With workers (or an executor), the rows are fitted in chunks of
+    chunk_size in separate processes. The rows come back as segment arrays,
+    in order, and are merged exactly as in the serial case, so the result is
+    identical.
+
+    With a cache, rows that have been fitted before are read from it instead
+    of being optimized again.
+
+    With a warm_start dict, keyed by Tuloluokka, each row's fit starts from
+    the solution stored for its bracket, and the new solutions are stored
+    back. Passing the same dict to the tables of consecutive years (or of
+    other groups) thus warm-starts each from the last.
+
+    In batch mode, the one-parameter fits of all rows are done together by
+    PiecewiseDensityBatchOptimizer, and only the rows it cannot solve are
+    optimized one by one. It cannot be combined with workers, an executor,
+    a cache or a warm_start dict.
+    """
+    N, mean, values = _matrix(table)
+    if batch:
+        assert (
+            cache is None and warm_start is None
+        ), "batch mode takes no cache or warm_start"
+        assert executor is None and workers is None, "batch mode runs serially"
+        return _to_density_batch(N, mean, values)
+    if executor is None and workers is not None and workers > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            return to_density(
+                table,
+                executor=executor,
+                chunk_size=chunk_size,
+                cache=cache,
+                warm_start=warm_start,
+            )
+    labels = _labels(table)
+    hints = None
+    if warm_start is not None:
+        hints = [warm_start.get(label) for label in labels]
+    if executor is None:
+        arrays = _fit_rows(N, mean, values, cache, hints, labels)
+    else:
+        starts = range(0, len(N), chunk_size)
+        chunks = executor.map(
+            _fit_rows,
+            [N[i : i + chunk_size] for i in starts],
+            [mean[i : i + chunk_size] for i in starts],
+            [values[i : i + chunk_size] for i in starts],
+            [cache] * len(starts),
+            [None if hints is None else hints[i : i + chunk_size] for i in starts],
+            [labels[i : i + chunk_size] for i in starts],
+        )
+        arrays = [a for chunk in chunks for a in chunk]
+    if warm_start is not None:
+        for label, (_, _, _, hint) in zip(labels, arrays):
+            # A zero-width first fixed segment gives no usable hint
+            if hint is not None and np.all(np.isfinite(hint)):
+                warm_start[label] = hint
+    return PiecewiseDensity.merge(
+        PiecewiseDensity.from_arrays(a, b, n) for a, b, n, _ in arrays
+    )
+
+
+def stream_density(
+    table,
+    sink: Sink,
+    buffer_segments: int = 1_000_000,
+    cache: DensityCache | None = None,
+) -> None:
+    """
+    Density of the whole table, passed to a sink instead of returned
+
+    Each row is fitted and handed to a StreamingMerger as soon as it is done,
+    so neither the rows nor the merged density are held in memory at once.
+    """
+    N, mean, values = _matrix(table)
+    finite = np.isfinite(values)
+    with StreamingMerger(sink, buffer_segments=buffer_segments) as merger:
+        for i in range(len(N)):
+            columns = np.flatnonzero(finite[i])
+            fracs = list(zip(values[i, columns], _FRACTILES[columns]))
+            merger.add(_fit(N[i], mean[i], fracs, cache)[0])
 
 
-def row_to_density(row) -> PiecewiseDensity | None:
+def row_to_density(row, cache: DensityCache | None = None) -> PiecewiseDensity | None:
     fracs = []
     for key, frac in _FRAC_KEYS:
         if key in row:
             if np.isfinite(row[key]):
                 fracs.append((row[key], frac))
+    return _fit(row.N, row.Mean, fracs, cache)[0]
+
+
+def _fit(
+    N: float,
+    mean: float,
+    fracs: list[tuple[float, float]],
+    cache: DensityCache | None = None,
+    hint: np.ndarray | None = None,
+) -> tuple[PiecewiseDensity, np.ndarray | None]:
+    """The density of one row, and its warm-start hint if it was optimized"""
     if len(fracs) > 0:
-        optimizer = PiecewiseDensityOptimizer(row.N, row.Mean, 0.0)
+        if cache is not None:
+            key = cache.key(N, mean, fracs, 0.0)
+            density = cache.get(key)
+            if density is not None:
+                return density, None
+        optimizer = PiecewiseDensityOptimizer(N, mean, 0.0)
         for f in fracs:
             optimizer.add(*f)
-        opt = optimizer.optimize()
+        opt = optimizer.optimize(hint)
         assert opt.success, opt
-        return optimizer.build()
+        density = optimizer.build()
+        if cache is not None:
+            cache.put(key, density)
+        return density, opt.hint
     else:
-        density = PiecewiseDensity()
-        density.add(Segment(row.Mean, row.Mean, row.N))
-        return density
+        return PiecewiseDensity.merge([Segment(mean, mean, N)]), None
+
+
+def _fit_rows(
+    N: np.ndarray,
+    mean: np.ndarray,
+    values: np.ndarray,
+    cache: DensityCache | None = None,
+    hints: list[np.ndarray | None] | None = None,
+    labels: np.ndarray | None = None,
+) -> list[tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray | None]]:
+    arrays = []
+    finite = np.isfinite(values)
+    rec = instrument.active()
+    for i in range(len(N)):
+        if rec is not None and labels is not None:
+            rec.context["bracket"] = labels[i]
+        columns = np.flatnonzero(finite[i])
+        fracs = list(zip(values[i, columns], _FRACTILES[columns]))
+        hint = None if hints is None else hints[i]
+        fd, hint = _fit(N[i], mean[i], fracs, cache, hint)
+        arrays.append((fd.va, fd.vb, fd.vn, hint))
+    if rec is not None:
+        rec.context.pop("bracket", None)
+    return arrays
+
+
+def _matrix(table) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """N, Mean and the fractile values of all rows except the total"""
+    keep = np.asarray(_column(table, "Tuloluokka")).astype(str) != "SS"
+    N = np.asarray(_column(table, "N"), dtype=np.float64)[keep]
+    mean = np.asarray(_column(table, "Mean"), dtype=np.float64)[keep]
+    values = np.full((len(N), len(_FRAC_KEYS)), np.nan)
+    for j, (key, _) in enumerate(_FRAC_KEYS):
+        column = _column(table, key)
+        if column is not None:
+            values[:, j] = np.asarray(column, dtype=np.float64)[keep]
+    return N, mean, values
+
+
+def _labels(table) -> np.ndarray:
+    """Tuloluokka of all rows except the total"""
+    labels = np.asarray(_column(table, "Tuloluokka")).astype(str)
+    return labels[labels != "SS"]
+
+
+def _column(table, key: str) -> np.ndarray | None:
+    """A column of a DataFrame, record array or Arrow table, if it has one"""
+    if isinstance(table, np.ndarray):
+        return table[key] if key in (table.dtype.names or ()) else None
+    if hasattr(table, "column_names"):
+        if key not in table.column_names:
+            return None
+        return table.column(key).to_numpy(zero_copy_only=False)
+    return table[key].to_numpy() if key in table else None
+
+
+def _to_density_batch(
+    N: np.ndarray, mean: np.ndarray, values: np.ndarray
+) -> PiecewiseDensity:
+    fitted = np.isfinite(values).any(axis=1)
+    optimizer = PiecewiseDensityBatchOptimizer(
+        N[fitted], mean[fitted], values[fitted], _FRACTILES, 0.0
+    )
+    success = optimizer.optimize()
+    assert success.all(), np.flatnonzero(~success)
+
+    parts: list[PiecewiseDensity | Segment] = []
+    j = 0
+    for i in range(len(N)):
+        if fitted[i]:
+            parts.append(optimizer.build(j))
+            j += 1
+        else:
+            parts.append(Segment(mean[i], mean[i], N[i]))
+    return PiecewiseDensity.merge(parts)
@@ -0,0 +1,55 @@
+from typing import Any, Callable
+
+import pandas as pd
+
+
+class Recorder:
+    """
+    Opt-in timing records of optimizations and merges
+
+    While a recorder is active (as a context manager), every
+    PiecewiseDensityOptimizer.optimize call and every PiecewiseDensity merge,
+    including those done by add, is recorded. An optimization record has the
+    Tuloluokka of the bracket being fitted (when fitted by to_density), the
+    branch taken ("init1" or "init3"), the wall time, scipy's nit and nfev,
+    the final score and the success flag. A merge record has the wall time, the number
+    of parts, and the segment counts before and after.
+
+    Only the calling process is recorded, so rows fitted by worker processes
+    are not. When no recorder is active, the hooks cost one global lookup.
+    """
+
+    def __init__(self, callback: Callable[[str, dict], Any] | None = None):
+        self.records: dict[str, list[dict]] = {"optimize": [], "merge": []}
+        self.context: dict[str, Any] = {}
+        self._callback = callback
+        self._previous: Recorder | None = None
+
+    def __enter__(self) -> "Recorder":
+        global _active
+        self._previous = _active
+        _active = self
+        return self
+
+    def __exit__(self, *exc) -> None:
+        global _active
+        _active = self._previous
+        self._previous = None
+
+    def record(self, kind: str, **fields) -> None:
+        record = {**self.context, **fields}
+        self.records.setdefault(kind, []).append(record)
+        if self._callback is not None:
+            self._callback(kind, record)
+
+    def to_frame(self, kind: str = "optimize") -> pd.DataFrame:
+        """Records of one kind as a table, one row per record"""
+        return pd.DataFrame.from_records(self.records.get(kind, []))
+
+
+_active: Recorder | None = None
+
+
+def active() -> Recorder | None:
+    """The recorder in effect, if any"""
+    return _active
@@ -0,0 +1,107 @@
+from typing import Hashable, Iterator, Mapping
+
+import numpy as np
+
+from verolysis.piecewise_density import PiecewiseDensity
+
+
+class KeyedDensity:
+    """
+    Sum of densities that remembers each part by key
+
+    Parts can be added, replaced and removed one at a time, e.g., when a
+    single bracket row is revised. Each change only rebuilds the segments in
+    the x range of the old and new part, and patches the cumulative index of
+    the sum instead of rebuilding it.
+    """
+
+    def __init__(self, parts: Mapping[Hashable, PiecewiseDensity] | None = None):
+        self._parts: dict[Hashable, PiecewiseDensity] = dict(parts or {})
+        self._density = PiecewiseDensity.merge(self._parts.values())
+
+    def __len__(self):
+        return len(self._parts)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(self._parts)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._parts
+
+    def __getitem__(self, key: Hashable) -> PiecewiseDensity:
+        return self._parts[key]
+
+    @property
+    def density(self) -> PiecewiseDensity:
+        """The sum of all parts"""
+        return self._density
+
+    def set(self, key: Hashable, f: PiecewiseDensity) -> None:
+        """Add a part, or replace the part with the same key"""
+        old = self._parts.get(key)
+        self._parts[key] = f
+        self._update(old, f)
+
+    def remove(self, key: Hashable) -> None:
+        """Remove a part"""
+        old = self._parts.pop(key)
+        self._update(old, None)
+
+    def _update(self, old: PiecewiseDensity | None, new: PiecewiseDensity | None):
+        changed = [g for g in (old, new) if g is not None and not g.empty]
+        if len(changed) == 0:
+            return
+        lo = min(g.xmin for g in changed)
+        hi = max(g.xmax for g in changed)
+        f = self._density
+
+        # Segments entirely outside [lo, hi] are kept as they are. The ones
+        # that cross or touch lo or hi are cut there and their outer pieces
+        # merged back in, so that they can be joined with the new segments
+        # if no part breaks at lo or hi anymore.
+        i = np.searchsorted(f.vb, lo, side="left")
+        j = np.searchsorted(f.va, hi, side="right")
+        outside = PiecewiseDensity.from_arrays(f.va[i:j], f.vb[i:j], f.vn[i:j])
+        pieces = [
+            outside._clip(-np.inf, lo, True, False),
+            *(
+                g._clip(lo, hi, True, True)
+                for g in self._parts.values()
+                if not g.empty and g.xmin <= hi and g.xmax >= lo
+            ),
+            outside._clip(hi, np.inf, False, True),
+        ]
+        middle = PiecewiseDensity.merge(
+            PiecewiseDensity.from_arrays(*piece) for piece in pieces
+        )
+        f._splice(i, j, *self._join(middle, lo, hi))
+
+    def _join(
+        self, f: PiecewiseDensity, lo: float, hi: float
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Join segments split at lo or hi when no part breaks there anymore"""
+        a, b, n = list(f.va), list(f.vb), list(f.vn)
+        k = 0
+        while k < len(a) - 1:
+            x = b[k]
+            if (
+                x in (lo, hi)
+                and a[k + 1] == x
+                and a[k] < x < b[k + 1]
+                and not self._is_breakpoint(x)
+            ):
+                b[k] = b.pop(k + 1)
+                n[k] += n.pop(k + 1)
+                a.pop(k + 1)
+            else:
+                k += 1
+        return np.array(a), np.array(b), np.array(n)
+
+    def _is_breakpoint(self, x: float) -> bool:
+        for g in self._parts.values():
+            if not g.empty and g.xmin <= x <= g.xmax:
+                i = np.searchsorted(g.va, x)
+                j = np.searchsorted(g.vb, x)
+                if (i < len(g) and g.va[i] == x) or (j < len(g) and g.vb[j] == x):
+                    return True
+        return False
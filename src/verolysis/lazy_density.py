@@ -0,0 +1,175 @@
+import numpy as np
+
+from verolysis.piecewise_density import PiecewiseDensity
+
+
+# Bisection stops once the leaves have at most this many segments in range
+_LOCAL_SEGMENTS = 64
+_MAX_BISECTIONS = 200
+
+
+class LazyDensity:
+    """
+    Deferred sums, differences and scalings of densities
+
+    Arithmetic on lazy densities records a small graph of leaf, sum and scale
+    nodes instead of merging segments. Since all of these are linear, the
+    graph reduces to a weighted sum of its leaves, and range queries are
+    answered from the leaves directly. Only icount needs merged segments,
+    and only those near the answer; materialize builds the whole density.
+    """
+
+    def __init__(self, f: PiecewiseDensity | None = None):
+        self._op = "leaf"
+        self._args: tuple = (PiecewiseDensity() if f is None else f,)
+        self._terms: list[tuple[float, PiecewiseDensity]] | None = None
+
+    @staticmethod
+    def _node(op: str, *args) -> "LazyDensity":
+        node = LazyDensity.__new__(LazyDensity)
+        node._op = op
+        node._args = args
+        node._terms = None
+        return node
+
+    def __add__(self, other) -> "LazyDensity":
+        if isinstance(other, PiecewiseDensity):
+            other = LazyDensity(other)
+        if not isinstance(other, LazyDensity):
+            return NotImplemented
+        return LazyDensity._node("sum", self, other)
+
+    def __radd__(self, other) -> "LazyDensity":
+        # Lets sum() start from 0
+        if isinstance(other, (int, float)) and other == 0:
+            return self
+        return self.__add__(other)
+
+    def __sub__(self, other) -> "LazyDensity":
+        if isinstance(other, PiecewiseDensity):
+            other = LazyDensity(other)
+        if not isinstance(other, LazyDensity):
+            return NotImplemented
+        return self + (-1.0 * other)
+
+    def __rsub__(self, other) -> "LazyDensity":
+        if not isinstance(other, PiecewiseDensity):
+            return NotImplemented
+        return LazyDensity(other) - self
+
+    def __mul__(self, k) -> "LazyDensity":
+        if not isinstance(k, (int, float, np.number)):
+            return NotImplemented
+        return LazyDensity._node("scale", float(k), self)
+
+    __rmul__ = __mul__
+
+    def __neg__(self) -> "LazyDensity":
+        return self * -1.0
+
+    def terms(self) -> list[tuple[float, PiecewiseDensity]]:
+        """The graph as (weight, leaf) pairs, each distinct leaf once"""
+        if self._terms is None:
+            weights: dict[int, list] = {}
+            stack = [(1.0, self)]
+            while stack:
+                w, node = stack.pop()
+                if node._op == "leaf":
+                    f = node._args[0]
+                    if id(f) in weights:
+                        weights[id(f)][0] += w
+                    else:
+                        weights[id(f)] = [w, f]
+                elif node._op == "scale":
+                    stack.append((w * node._args[0], node._args[1]))
+                else:
+                    stack.extend((w, arg) for arg in node._args)
+            self._terms = [
+                (w, f) for w, f in weights.values() if w != 0.0 and not f.empty
+            ]
+        return self._terms
+
+    @property
+    def empty(self) -> bool:
+        return len(self.terms()) == 0
+
+    @property
+    def xmin(self):
+        return min((f.xmin for _, f in self.terms()), default=None)
+
+    @property
+    def xmax(self):
+        return max((f.xmax for _, f in self.terms()), default=None)
+
+    def materialize(self) -> PiecewiseDensity:
+        """The density itself, merged from all leaves"""
+        return PiecewiseDensity.merge(w * f for w, f in self.terms())
+
+    def count(self, a=None, b=None) -> float:
+        """Integral of the density function, from a to b"""
+        return float(sum(w * f.count(a, b) for w, f in self.terms()))
+
+    def sum(self, a=None, b=None) -> float:
+        """Integral of x times the density function, from a to b"""
+        return float(sum(w * f.sum(a, b) for w, f in self.terms()))
+
+    def sum_above(self, a: float) -> float:
+        """Sum of only the excess of values above a"""
+        return self.sum(a, None) - (a * self.count(a, None))
+
+    def mean(self, a=None, b=None) -> float:
+        """Average of the function"""
+        N = self.count(a, b)
+        return self.sum(a, b) / N if N > 0.0 else np.nan
+
+    def tail_ratio(self, x: float) -> float:
+        """Ratio of mean above x to x"""
+        return self.mean(x, None) / x
+
+    def pareto(self, x: float) -> float:
+        """Pareto parameter of the tail above x"""
+        assert x >= 0
+        if x > 0:
+            r = self.tail_ratio(x)
+            return r / (r - 1)
+        else:
+            return 1.0
+
+    def icount(self, n, left=None, right=None) -> float:
+        """
+        Inverse count function
+
+        Finds x such that count(None, x) == n, for a combination whose
+        cumulative count does not decrease. The range holding x is narrowed
+        by bisection, using counts of the leaves, until the leaves have only
+        a few segments in it. Those are then merged to find x exactly.
+        """
+        terms = self.terms()
+        if n < 0 or len(terms) == 0:
+            return self.xmin if left is None else left
+        lo, hi = self.xmin, self.xmax
+        if n > self.count():
+            return hi if right is None else right
+        for _ in range(_MAX_BISECTIONS):
+            if self._segments_within(lo, hi) <= _LOCAL_SEGMENTS:
+                break
+            mid = lo + (hi - lo) / 2
+            if mid <= lo or mid >= hi:
+                break
+            if self.count(None, mid) < n:
+                lo = mid
+            else:
+                hi = mid
+        local = PiecewiseDensity.merge(
+            w * PiecewiseDensity.from_arrays(*f._clip(lo, hi, True, True))
+            for w, f in terms
+        )
+        return local.icount(n - self.count(None, lo), lo, hi)
+
+    def _segments_within(self, lo: float, hi: float) -> int:
+        k = 0
+        for _, f in self.terms():
+            i = np.searchsorted(f.vb, lo, side="left")
+            j = np.searchsorted(f.va, hi, side="right")
+            k += max(int(j - i), 0)
+        return k
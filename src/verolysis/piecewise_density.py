@@ -1,8 +1,14 @@
 import dataclasses
-from typing import Union
+import os
+import struct
+import time
+from pathlib import Path
+from typing import Iterable, Iterator, Literal, Union
 
 import numpy as np
 
+from verolysis import instrument
+
 
 class PiecewiseDensity:
     """
@@ -15,42 +21,113 @@ class PiecewiseDensity:
     Outside of any defined segments, the function is zero.
     """
 
+    # Cumulative counts and sums, from _require_index
+    _index: tuple[np.ndarray, np.ndarray] | None
+
     def __init__(self):
-        self._segments = []
+        self._set_arrays(np.empty(0), np.empty(0), np.empty(0))
+
+    @classmethod
+    def from_arrays(cls, a, b, n) -> "PiecewiseDensity":
+        """
+        Construct directly from segment arrays
+
+        The arrays must describe sorted, non-overlapping segments. They are
+        used as-is, without copying, whenever they are already contiguous
+        float64 arrays.
+        """
+        f = cls.__new__(cls)
+        f._set_arrays(a, b, n)
+        return f
+
+    def save(self, path: str | os.PathLike) -> None:
+        """
+        Write the segment arrays to a file
+
+        The file is a 16-byte header (magic, format version, segment count)
+        followed by the a, b and n columns as little-endian float64.
+        """
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as file:
+            file.write(_HEADER.pack(_MAGIC, _VERSION, len(self)))
+            for v in (self._a, self._b, self._n):
+                file.write(v.astype("<f8", copy=False).tobytes())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str | os.PathLike, mmap: bool = True) -> "PiecewiseDensity":
+        """
+        Read a file written by save
+
+        With mmap, the segment arrays are read-only views of the file, so
+        processes loading the same file share its pages instead of copying.
+        """
+        with open(path, "rb") as file:
+            header = file.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ValueError(f"{path} is not a PiecewiseDensity file")
+        magic, version, count = _HEADER.unpack(header)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a PiecewiseDensity file")
+        if version != _VERSION:
+            raise ValueError(f"{path} has unsupported format version {version}")
+        if count == 0:
+            return cls()
+        v: np.ndarray
+        if mmap:
+            v = np.memmap(path, "<f8", "r", offset=_HEADER.size, shape=(3, count))
+        else:
+            v = np.fromfile(path, "<f8", count=3 * count, offset=_HEADER.size)
+            if len(v) < 3 * count:
+                raise ValueError(f"{path} is truncated")
+            v = v.reshape(3, count)
+        return cls.from_arrays(v[0], v[1], v[2])
 
     def __len__(self):
-        return len(self._segments)
+        return len(self._a)
 
     def __getitem__(self, i):
-        return self._segments[i]
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return Segment(float(self._a[i]), float(self._b[i]), float(self._n[i]))
 
     @property
     def empty(self) -> bool:
-        return len(self._segments) == 0
+        return len(self) == 0
 
     @property
     def xmin(self):
-        return None if self.empty else self[0].a
+        return None if self.empty else float(self._a[0])
 
     @property
     def xmax(self):
-        return None if self.empty else self[-1].b
+        return None if self.empty else float(self._b[-1])
 
     @property
     def va(self):
-        return np.array([seg.a for seg in self._segments])
+        return self._a
 
     @property
     def vb(self):
-        return np.array([seg.b for seg in self._segments])
+        return self._b
+
+    @property
+    def vn(self):
+        return self._n
 
     @property
     def vw(self):
-        return np.array([seg.w for seg in self._segments])
+        if self._w is None:
+            self._w = _readonly(self._b - self._a)
+        return self._w
 
     @property
     def vh(self):
-        return np.array([seg.h for seg in self._segments])
+        if self._h is None:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                self._h = _readonly(self._n / self.vw)
+        return self._h
 
     def icount(self, n, left=None, right=None) -> float:
         """
@@ -60,31 +137,77 @@ class PiecewiseDensity:
         """
         if n < 0:
             return self.xmin if left is None else left
-        i = 0
-        for seg in self._segments:
-            j = i + seg.n
-            if j >= n:
-                dn = n - i
-                dx = dn / seg.h if seg.w > 0 else 0
-                return seg.a + dx
-            i = j
-        return self.xmax if right is None else right
+        if self.empty:
+            return self.xmax if right is None else right
+        return float(self.icount_many(n, left, right))
+
+    def icount_many(self, n, left=None, right=None) -> np.ndarray:
+        """Inverse count function, for an array of counts"""
+        n = np.asarray(n, dtype=np.float64)
+        if self.empty:
+            lo = np.nan if left is None else left
+            hi = np.nan if right is None else right
+            return np.where(n < 0, lo, hi)
+        cn, _ = self._require_index()
+        i = np.searchsorted(cn[1:], n, side="left")
+        k = np.minimum(i, len(self) - 1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            dx = np.where(self.vw[k] > 0, (n - cn[k]) / self.vh[k], 0.0)
+        x = self._a[k] + dx
+        x = np.where(i == len(self), self.xmax if right is None else right, x)
+        return np.where(n < 0, self.xmin if left is None else left, x)
 
     def uniform_sample(
         self, k, leftpad=None, rightpad=None, left=None, right=None
-    ) -> float:
+    ) -> np.ndarray:
         """Uniform sampling of values"""
+        a, step = self._uniform_steps(k, leftpad, rightpad)
+        return self.icount_many(a + (np.arange(k) + 0.5) * step, left, right)
+
+    def iter_uniform_sample(
+        self,
+        k,
+        leftpad=None,
+        rightpad=None,
+        left=None,
+        right=None,
+        chunk_size: int = 1_000_000,
+    ) -> Iterator[np.ndarray]:
+        """
+        Uniform sampling of values, in blocks of at most chunk_size
+
+        The concatenated blocks equal uniform_sample(k, ...), but only one
+        block is held in memory at a time.
+        """
+        a, step = self._uniform_steps(k, leftpad, rightpad)
+        for i in range(0, k, chunk_size):
+            j = np.arange(i, min(i + chunk_size, k))
+            yield self.icount_many(a + (j + 0.5) * step, left, right)
+
+    def random_sample(self, k, rng=None, left=None, right=None) -> np.ndarray:
+        """
+        Random sampling of values by inverse transform
+
+        The rng can be a numpy.random.Generator or anything accepted by
+        numpy.random.default_rng, such as a seed.
+        """
+        rng = np.random.default_rng(rng)
+        return self.icount_many(rng.uniform(0.0, self.count(), k), left, right)
+
+    def iter_random_sample(
+        self, k, rng=None, left=None, right=None, chunk_size: int = 1_000_000
+    ) -> Iterator[np.ndarray]:
+        """Random sampling of values, in blocks of at most chunk_size"""
+        rng = np.random.default_rng(rng)
+        for i in range(0, k, chunk_size):
+            yield self.random_sample(min(chunk_size, k - i), rng, left, right)
+
+    def _uniform_steps(self, k, leftpad, rightpad) -> tuple[float, float]:
         assert leftpad is None or rightpad is None
         count = self.count()
         a = count - leftpad if leftpad else 0
         b = rightpad if rightpad else count
-        step = (b - a) / k
-        return np.array(
-            [
-                self.icount(a + (i + 0.5) * step, left=left, right=right)
-                for i in range(k)
-            ]
-        )
+        return a, (b - a) / k
 
     def count(self, a=None, b=None) -> float:
         """
@@ -92,12 +215,11 @@ class PiecewiseDensity:
 
         None means infinity (negative infinity for a, positive for b).
         """
-        n = 0.0
-        for seg in self._segments:
-            overlap = seg.overlap(a, b)
-            if overlap:
-                n += overlap.n
-        return n
+        return float(self._integral(a, b, 0))
+
+    def count_many(self, a=None, b=None) -> np.ndarray:
+        """Integral of the density function, for arrays of ranges"""
+        return self._integral(a, b, 0)
 
     def sum(self, a=None, b=None) -> float:
         """
@@ -105,12 +227,11 @@ class PiecewiseDensity:
 
         None means infinity (negative infinity for a, positive for b).
         """
-        n = 0.0
-        for seg in self._segments:
-            overlap = seg.overlap(a, b)
-            if overlap:
-                n += overlap.s
-        return n
+        return float(self._integral(a, b, 1))
+
+    def sum_many(self, a=None, b=None) -> np.ndarray:
+        """Integral of the density function times x, for arrays of ranges"""
+        return self._integral(a, b, 1)
 
     def sum_above(self, a: float) -> float:
         """Sum of only the excess of values above a"""
@@ -122,11 +243,14 @@ class PiecewiseDensity:
 
         None means infinity (negative infinity for a, positive for b).
         """
-        N = self.count(a, b)
-        if N > 0.0:
-            return self.sum(a, b) / N
-        else:
-            return np.nan
+        return float(self.mean_many(a, b))
+
+    def mean_many(self, a=None, b=None) -> np.ndarray:
+        """Average of the function, for arrays of ranges"""
+        N = self._integral(a, b, 0)
+        S = self._integral(a, b, 1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(N > 0.0, S / N, np.nan)
 
     def tail_ratio(self, x: float) -> float:
         """
@@ -137,6 +261,12 @@ class PiecewiseDensity:
         """
         return self.mean(x, None) / x
 
+    def tail_ratio_curve(self, x) -> np.ndarray:
+        """Ratio of mean above x to x, for an array of x"""
+        x = np.asarray(x, dtype=np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.mean_many(x, None) / x
+
     def pareto(self, x: float) -> float:
         """Pareto parameter of the tail above x"""
         assert x >= 0
@@ -146,31 +276,393 @@ class PiecewiseDensity:
         else:
             return 1.0
 
-    def add(self, arg: Union["Segment", "PiecewiseDensity"]) -> None:
-        """Sum a new segment into this function"""
-        if isinstance(arg, Segment):
-            return self._add_segment(arg)
-        else:
-            for seg in arg._segments:
-                self._add_segment(seg)
+    def pareto_curve(self, x) -> np.ndarray:
+        """Pareto parameter of the tail above x, for an array of x"""
+        x = np.asarray(x, dtype=np.float64)
+        assert np.all(x >= 0)
+        r = self.tail_ratio_curve(x)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(x > 0, r / (r - 1), 1.0)
+
+    def _integral(self, a, b, moment: int) -> np.ndarray:
+        """Integral of x**moment times the density over [a, b)"""
+        a = np.asarray(-np.inf if a is None else a, dtype=np.float64)
+        b = np.asarray(np.inf if b is None else b, dtype=np.float64)
+        a, b = np.broadcast_arrays(a, b)
+        lo = self._cumulative(a, moment, False)
+        hi = self._cumulative(b, moment, False)
+        # When a == b, only point masses exactly at a are counted
+        at = self._cumulative(a, moment, True) - lo
+        return np.where(a < b, hi - lo, np.where(a == b, at, 0.0))
+
+    def _cumulative(self, x, moment: int, inclusive: bool):
+        """
+        Integral of x**moment times the density below x
 
-    def _add_segment(self, seg: "Segment") -> None:
-        if len(self._segments) == 0:
-            self._segments = [seg]
-        else:
-            self._assimilate(seg)
+        Point masses at exactly x are included only if inclusive is set. The
+        argument can be an array, in which case so is the result.
+        """
+        if self.empty:
+            return np.zeros(np.shape(x))
+        index = self._require_index()
+        side: Literal["left", "right"] = "right" if inclusive else "left"
+        i = np.searchsorted(self._a, x, side=side)
+        k = np.maximum(i - 1, 0)
+        a, w, n = self._a[k], self.vw[k], self._n[k]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            frac = np.where(w > 0, np.clip((x - a) / w, 0.0, 1.0), 1.0)
+            partial = n * frac
+            if moment == 1:
+                partial = partial * (a + np.minimum(x, self._b[k])) / 2
+        return index[moment][i - (i > 0)] + np.where(i > 0, partial, 0.0)
+
+    def _require_index(self) -> tuple[np.ndarray, np.ndarray]:
+        """Cumulative counts and sums, built on first use"""
+        if self._index is None:
+            s = self._n * (self._a + self._b) / 2
+            self._index = (
+                _readonly(np.concatenate([[0.0], np.cumsum(self._n)])),
+                _readonly(np.concatenate([[0.0], np.cumsum(s)])),
+            )
+        return self._index
+
+    def add(self, arg: Union["Segment", "PiecewiseDensity", Iterable]) -> None:
+        """
+        Sum new segments into this function
+
+        The argument can be a segment, a density, or an iterable of those, in
+        which case they are all merged in at once.
+        """
+        if isinstance(arg, (Segment, PiecewiseDensity)):
+            arg = [arg]
+        merged = PiecewiseDensity.merge([self, *arg])
+        self._set_arrays(merged._a, merged._b, merged._n)
+
+    def __add__(self, other) -> "PiecewiseDensity":
+        if not isinstance(other, (Segment, PiecewiseDensity)):
+            return NotImplemented
+        return PiecewiseDensity.merge([self, other])
+
+    def __radd__(self, other) -> "PiecewiseDensity":
+        # Lets sum() start from 0
+        if isinstance(other, (int, float)) and other == 0:
+            return self
+        return self.__add__(other)
+
+    def __sub__(self, other) -> "PiecewiseDensity":
+        """Difference of densities, whose counts can be negative"""
+        if isinstance(other, Segment):
+            other = PiecewiseDensity.from_arrays([other.a], [other.b], [other.n])
+        if not isinstance(other, PiecewiseDensity):
+            return NotImplemented
+        return PiecewiseDensity.merge([self, -other])
+
+    def __mul__(self, k) -> "PiecewiseDensity":
+        """Density with every count multiplied by k, sharing the x arrays"""
+        if not isinstance(k, (int, float, np.number)):
+            return NotImplemented
+        return PiecewiseDensity.from_arrays(self._a, self._b, self._n * k)
+
+    __rmul__ = __mul__
+
+    def __neg__(self) -> "PiecewiseDensity":
+        return self * -1.0
+
+    def shift(self, dx: float) -> "PiecewiseDensity":
+        """Density moved right by dx"""
+        return PiecewiseDensity.from_arrays(self._a + dx, self._b + dx, self._n)
+
+    def scale_x(self, k: float) -> "PiecewiseDensity":
+        """
+        Density stretched along x by a factor k > 0, keeping the counts
 
-    def _assimilate(self, incoming: Union["Segment", None]) -> None:
-        segments = []
-        for existing in self._segments:
-            if incoming is None:
-                segments.append(existing)
+        E.g., scaling by a price index turns nominal incomes into real ones.
+        """
+        assert k > 0
+        return PiecewiseDensity.from_arrays(self._a * k, self._b * k, self._n)
+
+    @staticmethod
+    def merge(
+        parts: Iterable[Union["Segment", "PiecewiseDensity"]],
+    ) -> "PiecewiseDensity":
+        """
+        Sum of any number of densities (or segments)
+
+        All breakpoints are sorted together and the heights summed in a single
+        pass, so merging densities of n and m segments is O((n + m) log(n + m))
+        however many parts there are, and however much they overlap. Segments
+        are split at every breakpoint, and point masses at the same location
+        are combined.
+        """
+        va: list[np.ndarray] = []
+        vb: list[np.ndarray] = []
+        vn: list[np.ndarray] = []
+        for part in parts:
+            if isinstance(part, Segment):
+                va.append(np.array([part.a]))
+                vb.append(np.array([part.b]))
+                vn.append(np.array([part.n]))
             else:
-                processed, incoming = Segment.merge(existing, incoming)
-                segments += processed
-        if incoming:
-            segments.append(incoming)
-        self._segments = segments
+                va.append(part._a)
+                vb.append(part._b)
+                vn.append(part._n)
+        if len(va) == 0:
+            return PiecewiseDensity()
+        rec = instrument.active()
+        if rec is not None:
+            start = time.perf_counter()
+        f = PiecewiseDensity.from_arrays(
+            *_sweep(
+                np.concatenate(va).astype(np.float64),
+                np.concatenate(vb).astype(np.float64),
+                np.concatenate(vn).astype(np.float64),
+            )
+        )
+        if rec is not None:
+            rec.record(
+                "merge",
+                time=time.perf_counter() - start,
+                parts=len(va),
+                segments_in=sum(len(v) for v in va),
+                segments_out=len(f),
+            )
+        return f
+
+    def compress(self, tolerance: float) -> tuple["PiecewiseDensity", float]:
+        """
+        Merge runs of adjacent segments of similar height
+
+        A run is a sequence of touching segments where the heights of each
+        neighbouring pair differ by at most the given relative tolerance. Each
+        run of three or more segments is replaced by two segments that keep
+        its count and sum exactly. Segments with no count, and counts of
+        opposite sign, are never joined. Also returns the largest difference in
+        cumulative count between the original and the compressed density.
+        """
+        if self.empty:
+            return PiecewiseDensity(), 0.0
+        a, b, n, h = self._a, self._b, self._n, self.vh
+        wide = self.vw > 0
+        with np.errstate(invalid="ignore"):
+            close = np.abs(h[1:] - h[:-1]) <= tolerance * np.maximum(
+                np.abs(h[1:]), np.abs(h[:-1])
+            )
+        # Zero counts are kept as they are, and runs do not change sign
+        sign = np.sign(n)
+        join = wide[1:] & wide[:-1] & (b[:-1] == a[1:]) & close
+        join &= (sign[1:] == sign[:-1]) & (sign[1:] != 0)
+        run = np.concatenate([[0], np.cumsum(~join)])
+        size = np.bincount(run)
+        long = size[run] >= 3
+
+        # Segments in short runs are kept, long runs are summed up
+        s = n * (a + b) / 2
+        runs = np.flatnonzero(size >= 3)
+        starts = np.searchsorted(run, runs, side="left")
+        ends = np.searchsorted(run, runs, side="right") - 1
+        N = np.bincount(run, n)[runs]
+        S = np.bincount(run, s)[runs]
+        pieces = _two_piece(a[starts], b[ends], N, S)
+        g = PiecewiseDensity.from_arrays(
+            *(np.concatenate([v[~long], pv]) for v, pv in zip((a, b, n), pieces))
+        )
+        g = PiecewiseDensity.merge([g])
+        return g, _cdf_distance(self, g)
+
+    def rebin(self, edges) -> tuple["PiecewiseDensity", float]:
+        """
+        Resample onto bins between the given edges
+
+        Each bin is represented by at most two segments, split so that the
+        count and sum within the bin are kept exactly. The edges must cover
+        all of the density; the last bin includes its right edge. Also
+        returns the largest difference in cumulative count between the
+        original and the rebinned density. Raises ValueError if counts of
+        opposite sign within a bin put its mean outside of it.
+        """
+        edges = np.asarray(edges, dtype=np.float64)
+        assert len(edges) >= 2 and np.all(np.diff(edges) > 0)
+        counts = []
+        for moment in (0, 1):
+            c = self._cumulative(edges, moment, False)
+            c[-1] = self._cumulative(edges[-1], moment, True)
+            counts.append(c)
+        total = float(self._integral(None, None, 0))
+        outside = counts[0][0] + (total - counts[0][-1])
+        if not np.isclose(outside, 0.0, atol=1e-9 * max(abs(total), 1.0)):
+            raise ValueError("edges do not cover the density")
+        N, S = np.diff(counts[0]), np.diff(counts[1])
+        nonzero = N != 0
+        lo, hi = edges[:-1] * N, edges[1:] * N
+        tol = 1e-9 * (np.abs(lo) + np.abs(hi) + np.max(np.abs(counts[1])))
+        inside = (np.minimum(lo, hi) - tol <= S) & (S <= np.maximum(lo, hi) + tol)
+        if not np.all(np.where(nonzero, inside, np.abs(S) <= tol)):
+            raise ValueError("bin mean is outside of the bin")
+        pieces = _two_piece(
+            edges[:-1][nonzero], edges[1:][nonzero], N[nonzero], S[nonzero]
+        )
+        g = PiecewiseDensity.merge([PiecewiseDensity.from_arrays(*pieces)])
+        return g, _cdf_distance(self, g)
+
+    def restrict(self, a=None, b=None) -> "PiecewiseDensity":
+        """
+        The part of the density within [a, b)
+
+        Segments crossing a or b are cut, so that restrict(a, b).count()
+        equals count(a, b). Only the segments in the range are visited.
+        """
+        if a is not None and b is not None and a == b:
+            return PiecewiseDensity.from_arrays(*self._clip(a, a, True, True))
+        lo = -np.inf if a is None else a
+        hi = np.inf if b is None else b
+        return PiecewiseDensity.from_arrays(*self._clip(lo, hi, True, False))
+
+    def _clip(
+        self, lo: float, hi: float, include_lo: bool, include_hi: bool
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Segment arrays cut to the range from lo to hi"""
+        i = np.searchsorted(self._b, lo, side="left")
+        j = np.searchsorted(self._a, hi, side="right")
+        a, b, n = self._a[i:j], self._b[i:j], self._n[i:j]
+        wide = b > a
+        ca = np.maximum(a, lo)
+        cb = np.minimum(b, hi)
+        inside = np.where(wide, cb > ca, (a > lo) & (a < hi))
+        if include_lo:
+            inside |= ~wide & (a == lo)
+        if include_hi:
+            inside |= ~wide & (a == hi)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cn = np.where(wide, n * ((cb - ca) / (b - a)), n)
+        ca, cb = np.where(wide, ca, a), np.where(wide, cb, b)
+        return ca[inside], cb[inside], cn[inside]
+
+    def _splice(self, i: int, j: int, a, b, n) -> None:
+        """
+        Replace segments i to j (exclusive) with new ones
+
+        The cumulative index is patched rather than dropped: the part before i
+        is kept, the new segments are summed, and the part after j is shifted.
+        """
+        index = self._index
+        a, b, n = (np.asarray(v, dtype=np.float64) for v in (a, b, n))
+        self._set_arrays(
+            np.concatenate([self._a[:i], a, self._a[j:]]),
+            np.concatenate([self._b[:i], b, self._b[j:]]),
+            np.concatenate([self._n[:i], n, self._n[j:]]),
+        )
+        if index is not None:
+            patched = []
+            for c, v in zip(index, (n, n * (a + b) / 2)):
+                middle = c[i] + np.cumsum(v)
+                end = middle[-1] if len(middle) else c[i]
+                after = c[j + 1 :] - c[j] + end
+                patched.append(_readonly(np.concatenate([c[: i + 1], middle, after])))
+            self._index = (patched[0], patched[1])
+
+    def _set_arrays(self, a, b, n) -> None:
+        self._a = _readonly(np.ascontiguousarray(a, dtype=np.float64))
+        self._b = _readonly(np.ascontiguousarray(b, dtype=np.float64))
+        self._n = _readonly(np.ascontiguousarray(n, dtype=np.float64))
+        assert self._a.shape == self._b.shape == self._n.shape
+        self._w = None
+        self._h = None
+        self._index = None
+
+
+def _sweep(
+    a: np.ndarray, b: np.ndarray, n: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Sweep-line sum of possibly overlapping segments"""
+    wide = b > a
+    ia, ib, iw, i_n = a[wide], b[wide], b[wide] - a[wide], n[wide]
+    pa, pn = a[~wide], n[~wide]
+
+    # Intervals: split at every breakpoint, including the point masses, and
+    # sum the heights over the pieces with a running sum of height changes.
+    # The running sum starts again from zero after every gap in coverage, and
+    # a piece covered by a single interval takes its count from that interval
+    # directly, so an interval that is not split keeps its count exactly.
+    x, inverse = np.unique(np.concatenate([ia, ib, pa]), return_inverse=True)
+    pw = np.diff(x)
+    i, j = inverse[: len(ia)], inverse[len(ia) : 2 * len(ia)]
+    k = len(x)
+    depth = np.cumsum(np.bincount(i, None, k) - np.bincount(j, None, k))[:-1]
+    ids = np.arange(len(ia), dtype=np.float64)
+    owner = np.cumsum(np.bincount(i, ids, k) - np.bincount(j, ids, k))[:-1]
+    ih = i_n / iw
+    height = np.cumsum(np.bincount(i, ih, k) - np.bincount(j, ih, k))[:-1]
+    start = (depth > 0) & (np.concatenate([[0], depth])[:-1] == 0)
+    base = np.concatenate([[0.0], height])[np.flatnonzero(start)]
+    height = height - np.concatenate([[0.0], base])[np.cumsum(start)]
+    counts = height * pw
+    single = np.flatnonzero(depth == 1)
+    one = owner[single].astype(np.intp)
+    counts[single] = i_n[one] * (pw[single] / iw[one])
+    covered = depth > 0
+    sa = x[:-1][covered]
+    sb = x[1:][covered]
+    sn = counts[covered]
+
+    # Point masses: combine those at the same location
+    px, inverse = np.unique(pa, return_inverse=True)
+    pn = np.bincount(inverse.ravel(), pn, len(px))
+
+    # A point mass goes after intervals ending at it and before intervals
+    # starting at it
+    ra = np.concatenate([sa, px])
+    rb = np.concatenate([sb, px])
+    rn = np.concatenate([sn, pn])
+    kind = np.concatenate([np.ones(len(sa)), np.zeros(len(px))])
+    order = np.lexsort((kind, ra))
+    return ra[order], rb[order], rn[order]
+
+
+def _two_piece(
+    a: np.ndarray, b: np.ndarray, N: np.ndarray, S: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Two uniform segments on [a, m) and [m, b) with total count N and sum S
+
+    The split m is the midpoint, moved just enough towards the mean for
+    both counts to have the sign of N. N must not be zero. Pieces with no
+    count are dropped.
+    """
+    sign = np.sign(N)
+    N, S = N * sign, S * sign
+    mu = S / N
+    m = np.clip((a + b) / 2, 2 * mu - b, 2 * mu - a)
+    m = np.clip(m, a, b)
+    n1 = np.clip((N * (m + b) - 2 * S) / (b - a), 0.0, N)
+    n2 = N - n1
+    n1, n2 = n1 * sign, n2 * sign
+    ra = np.stack([a, m], axis=1).ravel()
+    rb = np.stack([m, b], axis=1).ravel()
+    rn = np.stack([n1, n2], axis=1).ravel()
+    keep = rn != 0
+    return ra[keep], rb[keep], rn[keep]
+
+
+def _cdf_distance(f: PiecewiseDensity, g: PiecewiseDensity) -> float:
+    """Largest difference between the cumulative counts of f and g"""
+    x = np.unique(np.concatenate([f.va, f.vb, g.va, g.vb]))
+    d = 0.0
+    for inclusive in (False, True):
+        fx = f._cumulative(x, 0, inclusive)
+        gx = g._cumulative(x, 0, inclusive)
+        d = max(d, float(np.max(np.abs(fx - gx), initial=0.0)))
+    return d
+
+
+_MAGIC = b"VLPD"
+_VERSION = 1
+_HEADER = struct.Struct("<4sIQ")
+
+
+def _readonly(v: np.ndarray) -> np.ndarray:
+    v = v.view()
+    v.flags.writeable = False
+    return v
 
 
 @dataclasses.dataclass
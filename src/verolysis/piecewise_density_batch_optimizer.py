@@ -0,0 +1,348 @@
+import numpy as np
+
+from verolysis.piecewise_density import PiecewiseDensity
+from verolysis.piecewise_density_optimizer import PiecewiseDensityOptimizer
+
+
+_GOLDEN = (np.sqrt(5.0) - 1.0) / 2.0
+
+
+class PiecewiseDensityBatchOptimizer:
+    """
+    Optimizing builder for many PiecewiseDensity rows at once
+
+    Each row is the same problem as PiecewiseDensityOptimizer: a count N, a
+    mean, and the values at some fractiles. Missing fractiles are NaN. The
+    one-parameter fringe problems of all rows are solved together by a
+    vectorized golden-section search over the bracket of FringeCondition,
+    and the three-parameter problems by vectorized projected Newton steps.
+    Rows that are not valid, or where either search does not converge, fall
+    back to PiecewiseDensityOptimizer one by one.
+    """
+
+    def __init__(
+        self,
+        N: np.ndarray,
+        mean: np.ndarray,
+        values: np.ndarray,
+        fractiles: np.ndarray,
+        amin: float = -np.inf,
+        xatol: float = 1e-5,
+        gtol: float = 1e-10,
+    ):
+        N = np.asarray(N, dtype=np.float64)
+        fractiles = np.asarray(fractiles, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64).reshape(len(N), -1)
+        assert values.shape[1] == len(fractiles)
+        assert np.all((fractiles > 0.0) & (fractiles < 1.0))
+
+        # Move the finite values of each row to the front, in fractile order
+        order = np.argsort(fractiles, kind="stable")
+        values = values[:, order]
+        fractiles = fractiles[order]
+        finite = np.isfinite(values)
+        compact = np.argsort(~finite, axis=1, kind="stable")
+        self._values = np.take_along_axis(values, compact, axis=1)
+        self._fractiles = fractiles[compact]
+        self._counts = finite.sum(axis=1)
+
+        self._N = N
+        self._mean = np.asarray(mean, dtype=np.float64)
+        self._amin = amin
+        self._xatol = xatol
+        self._gtol = gtol
+        self._x: list[np.ndarray | None] = [None] * len(N)
+        self._b = np.full(len(N), np.nan)
+        self._converged = np.zeros(len(N), dtype=bool)
+        self._success = np.zeros(len(N), dtype=bool)
+        self._fallbacks: dict[int, PiecewiseDensityOptimizer] = {}
+
+    def __len__(self):
+        return len(self._N)
+
+    @property
+    def converged(self) -> np.ndarray:
+        """Rows solved by the vectorized search"""
+        return self._converged
+
+    @property
+    def success(self) -> np.ndarray:
+        """Rows solved by either the vectorized search or the fallback"""
+        return self._success
+
+    def optimize(self) -> np.ndarray:
+        """Fit all rows, returning the per-row success mask"""
+        fr = _BatchFringeCondition(self)
+        a = fr.solve1(self._xatol)
+        x3 = fr.solve3(self._gtol)
+        one = np.isfinite(a)
+        three = np.all(np.isfinite(x3), axis=1)
+        for i in np.flatnonzero(one):
+            self._x[i] = a[i : i + 1]
+        for i in np.flatnonzero(three):
+            self._x[i] = x3[i]
+        a1, a0, n0 = x3.T
+        b3 = fr.ka * a1 + n0 * (fr.xL - a0) / fr.nR + fr.c
+        self._b = np.where(three, b3, fr.ka * a + fr.c)
+        self._converged = one | three
+        self._success = self._converged.copy()
+        for i in np.flatnonzero(~self._converged):
+            opt = self._fallback(int(i))
+            if opt.optimize().success:
+                self._x[i] = opt._x
+                self._success[i] = True
+        return self._success
+
+    def x(self, i: int) -> np.ndarray | None:
+        """Fitted fringe parameters of row i"""
+        return self._x[i]
+
+    def build(self, i: int) -> PiecewiseDensity:
+        """Density of row i"""
+        assert self._success[i]
+        if i in self._fallbacks:
+            return self._fallbacks[i].build()
+        c = self._counts[i]
+        values = self._values[i, :c]
+        fractiles = self._fractiles[i, :c]
+        xi = self._x[i]
+        assert xi is not None
+        if len(xi) == 1:
+            left, below = list(xi), [0.0]
+        else:
+            # Two left segments, [a0, a1) holding n0 and [a1, xL) the rest
+            a1, a0, n0 = xi
+            left, below = [a0, a1], [0.0, n0 / self._N[i]]
+        x = np.concatenate([left, values, [self._b[i]]])
+        n = self._N[i] * np.diff(np.concatenate([below, fractiles, [1.0]]))
+        f = PiecewiseDensity.from_arrays(x[:-1], x[1:], n)
+        if np.all(x[1:] > x[:-1]):
+            return f
+        # Repeated values are point masses, which merge puts in order
+        return PiecewiseDensity.merge([f])
+
+    def _fallback(self, i: int) -> PiecewiseDensityOptimizer:
+        opt = self._optimizer(i)
+        self._fallbacks[i] = opt
+        return opt
+
+    def _optimizer(self, i: int) -> PiecewiseDensityOptimizer:
+        opt = PiecewiseDensityOptimizer(self._N[i], self._mean[i], self._amin)
+        c = self._counts[i]
+        for value, fractile in zip(self._values[i, :c], self._fractiles[i, :c]):
+            opt.add(value, fractile)
+        return opt
+
+
+class _BatchFringeCondition:
+    """FringeCondition constants of every row, as arrays"""
+
+    def __init__(self, opt: PiecewiseDensityBatchOptimizer):
+        N, m, amin = opt._N, opt._mean, opt._amin
+        v, f, c = opt._values, opt._fractiles, opt._counts
+        rows = np.arange(len(N))
+        first = np.zeros(len(N), dtype=int)
+        last = np.maximum(c - 1, 0)
+        self.valid = c >= 2
+
+        # Fixed segments between consecutive known fractiles
+        with np.errstate(invalid="ignore"):
+            n = N[:, None] * np.diff(f, axis=1)
+            s = n * (v[:, :-1] + v[:, 1:]) / 2
+        inside = np.arange(v.shape[1] - 1)[None, :] < (c - 1)[:, None]
+        fixed_sum = np.where(inside, s, 0.0).sum(axis=1)
+
+        fL, xL = f[rows, first], v[rows, first]
+        fR, xR = f[rows, last], v[rows, last]
+        nL = N * fL
+        nR = N * (1.0 - fR)
+        C = N * m - fixed_sum
+        nC = nL + nR
+        self.valid &= nC > 0
+        if np.isfinite(amin):
+            self.valid &= C > amin * nC
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.ka = -(nL / nR)
+            self.c = (2 * C / nR) + (self.ka * xL) - xR
+            self.amax = np.minimum(xL, (xR - self.c) / self.ka)
+            if np.isfinite(amin):
+                self.left_coeff = (self.amax - amin) / (xL - amin)
+            else:
+                self.left_coeff = np.ones(len(N))
+        self.amin = amin
+        self.nL = nL
+        self.nR = nR
+        self.xL = xL
+        self.xR = xR
+        self.wL = v[rows, np.minimum(first + 1, last)] - xL
+        self.wR = xR - v[rows, np.maximum(last - 1, 0)]
+        self.valid &= np.isfinite(self.c) & np.isfinite(self.amax)
+
+    def score1(self, a: np.ndarray) -> np.ndarray:
+        b = (self.ka * a) + self.c
+        return _score_eq(self.wL, self.xL - a) + _score_eq(b - self.xR, self.wR)
+
+    def bracket1(self) -> tuple[np.ndarray, np.ndarray]:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            aL = self.xL - self.wL
+            aR = (self.xR + self.wR - self.c) / self.ka
+        lo = np.clip(np.minimum(aL, aR), self.amin, self.amax)
+        hi = np.clip(np.maximum(aL, aR), self.amin, self.amax)
+        return lo, hi
+
+    def solve1(self, xatol: float) -> np.ndarray:
+        """
+        Golden-section search of all brackets at once
+
+        The search assumes one minimum in the bracket. Rows where it ends up
+        worse than an end of the bracket, without being next to that end,
+        are not solved and come back as NaN.
+        """
+        lo, hi = self.bracket1()
+        ok = self.valid & (self.left_coeff >= 0.5)
+        lo = np.where(ok, lo, 0.0)
+        hi = np.where(ok, hi, 0.0)
+        ends = (lo, hi)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            x1 = hi - _GOLDEN * (hi - lo)
+            x2 = lo + _GOLDEN * (hi - lo)
+            f1 = self.score1(x1)
+            f2 = self.score1(x2)
+            while np.any(hi - lo > xatol):
+                left = f1 < f2
+                hi = np.where(left, x2, hi)
+                lo = np.where(left, lo, x1)
+                x1, x2 = (
+                    np.where(left, hi - _GOLDEN * (hi - lo), x2),
+                    np.where(left, x1, lo + _GOLDEN * (hi - lo)),
+                )
+                fnew = self.score1(np.where(left, x1, x2))
+                f1, f2 = np.where(left, fnew, f2), np.where(left, f1, fnew)
+            a = (lo + hi) / 2
+            fa = self.score1(a)
+            f_lo, f_hi = self.score1(ends[0]), self.score1(ends[1])
+            end = np.where(f_lo <= f_hi, ends[0], ends[1])
+            ok &= (fa <= np.minimum(f_lo, f_hi)) | (np.abs(a - end) <= xatol)
+        return np.where(ok & np.isfinite(fa), a, np.nan)
+
+    def solve3(self, gtol: float, maxiter: int = 100) -> np.ndarray:
+        """
+        Projected Newton search of all three-parameter problems at once
+
+        The score only depends on a0 through n0 * (xL - a0) in b, so for any
+        b the least n0, and so the least score, has a0 at amin. The search is
+        then over a1 and n0, in the coordinates u = (xL - a1) / wL and
+        v = n0 / nL, where every term of the score is scale-free. It starts
+        where the scalar optimizer does. Rows whose projected gradient does
+        not fall below gtol are not solved and come back as NaN.
+        """
+        ok = self.valid & (self.left_coeff < 0.5) & (self.wL > 0) & (self.wR > 0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            hi = np.stack([(self.xL - self.amin) / self.wL, np.ones(len(ok))], 1)
+        hi = np.where(ok[:, None], hi, 1.0)
+        x = hi / 2
+        done = ~ok
+        for _ in range(maxiter):
+            f, g, H = self._derivs3(x)
+            pg = x - np.clip(x - g, 0.0, hi)
+            done |= np.max(np.abs(pg), axis=1) < gtol
+            if done.all():
+                break
+            d = self._newton3(x, g, H, hi)
+            # Backtrack along the projected path until the score drops enough
+            step = np.ones(len(x))
+            moving = ~done
+            for _ in range(50):
+                xn = np.clip(x + step[:, None] * d, 0.0, hi)
+                fn = self._score3(xn)
+                enough = fn <= f + 1e-4 * np.sum(g * (xn - x), axis=1)
+                accept = moving & enough
+                x[accept] = xn[accept]
+                moving &= ~enough
+                if not moving.any():
+                    break
+                step = np.where(moving, step / 2, step)
+            # A row where no step helps is at a point the search cannot leave
+            ok &= ~moving
+            done |= moving
+        ok &= done & np.all(np.isfinite(x), axis=1)
+        a1 = self.xL - self.wL * x[:, 0]
+        n0 = self.nL * x[:, 1]
+        a0 = np.full(len(x), self.amin)
+        return np.where(ok[:, None], np.stack([a1, a0, n0], 1), np.nan)
+
+    def _beta(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(b - xR) / wR as b0 + bu * u + bv * v"""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            b0 = ((self.ka * self.xL) + self.c - self.xR) / self.wR
+            bu = -self.ka * self.wL / self.wR
+            bv = self.nL * (self.xL - self.amin) / (self.nR * self.wR)
+        return b0, bu, bv
+
+    def _score3(self, x: np.ndarray) -> np.ndarray:
+        b0, bu, bv = self._beta()
+        u, v = x[:, 0], x[:, 1]
+        return _score_ratio(u)[0] + v**2 + _score_ratio(b0 + bu * u + bv * v)[0]
+
+    def _derivs3(self, x: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Score, gradient and Hessian in (u, v)"""
+        b0, bu, bv = self._beta()
+        u, v = x[:, 0], x[:, 1]
+        su, du, ddu = _score_ratio(u)
+        sb, db, ddb = _score_ratio(b0 + bu * u + bv * v)
+        g = np.stack([du + bu * db, 2 * v + bv * db], 1)
+        H = np.empty((len(x), 2, 2))
+        H[:, 0, 0] = ddu + bu**2 * ddb
+        H[:, 0, 1] = H[:, 1, 0] = bu * bv * ddb
+        H[:, 1, 1] = 2 + bv**2 * ddb
+        return su + v**2 + sb, g, H
+
+    @staticmethod
+    def _newton3(
+        x: np.ndarray, g: np.ndarray, H: np.ndarray, hi: np.ndarray
+    ) -> np.ndarray:
+        """
+        Newton direction over the coordinates that are free to move
+
+        A coordinate at a bound, with the gradient pushing it out, stays
+        where it is. The Hessian of the rest is shifted to be positive
+        definite where the score is not convex.
+        """
+        bound = ((x <= 0.0) & (g > 0)) | ((x >= hi) & (g < 0))
+        free = (~bound).astype(np.float64)
+        H = H * free[:, :, None] * free[:, None, :]
+        H[:, 0, 0] += 1.0 - free[:, 0]
+        H[:, 1, 1] += 1.0 - free[:, 1]
+        mid = (H[:, 0, 0] + H[:, 1, 1]) / 2
+        low = mid - np.hypot((H[:, 0, 0] - H[:, 1, 1]) / 2, H[:, 0, 1])
+        shift = np.maximum(1e-8 - low, 0.0)
+        h00, h11, h01 = H[:, 0, 0] + shift, H[:, 1, 1] + shift, H[:, 0, 1]
+        det = h00 * h11 - h01**2
+        g = g * free
+        d0 = -(h11 * g[:, 0] - h01 * g[:, 1]) / det
+        d1 = -(h00 * g[:, 1] - h01 * g[:, 0]) / det
+        return np.stack([d0, d1], 1)
+
+
+def _score_ratio(t: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Value and first two derivatives of _score_eq(1, t)
+
+    Below 1 the ratio is t itself, and above 1 it is 1 / t. The score and
+    its first two derivatives are continuous at 1.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = np.where(t > 1, 1 / t, t)
+    below = t <= 1
+    value = (r - 1) ** 2
+    d1 = np.where(below, 2 * (t - 1), -2 * (r - 1) * r**2)
+    d2 = np.where(below, 2.0, 6 * r**4 - 4 * r**3)
+    return value, d1, d2
+
+
+def _score_eq(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Vectorized FringeCondition._score_eq"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = np.minimum(a, b) / np.maximum(a, b)
+    return np.where((a == 0) | (b == 0), 1.0, (r - 1) ** 2)
@@ -1,25 +1,46 @@
-from verolysis.piecewise_density import PiecewiseDensity, Segment
+import numpy as np
+
+from verolysis.piecewise_density import PiecewiseDensity
 
 
 class PiecewiseDensityBuilder:
     """
     Build a PiecewiseDensity out of increasing steps
+
+    Each step is a cumulative count and the value it is reached at. Both
+    must be strictly increasing, so the segments between consecutive steps
+    are already sorted and do not overlap, and build needs no merging.
     """
 
     def __init__(self):
-        self._segments = []
-        self._prev = None
+        self._counts: list[np.ndarray] = []
+        self._values: list[np.ndarray] = []
+        self._prev: tuple[float, float] | None = None
 
     def add(self, count, value):
+        self.add_many([count], [value])
+
+    def add_many(self, counts, values):
+        """Add several steps, given as arrays of counts and values"""
+        counts = np.asarray(counts, dtype=np.float64).ravel()
+        values = np.asarray(values, dtype=np.float64).ravel()
+        assert counts.shape == values.shape
+        if len(counts) == 0:
+            return
         if self._prev is not None:
             pcount, pvalue = self._prev
-            assert count > pcount
-            assert value > pvalue
-            self._segments.append(Segment(pvalue, value, count - pcount))
-        self._prev = (count, value)
+            assert np.all(np.diff(counts, prepend=pcount) > 0)
+            assert np.all(np.diff(values, prepend=pvalue) > 0)
+        else:
+            assert np.all(np.diff(counts) > 0)
+            assert np.all(np.diff(values) > 0)
+        self._counts.append(counts)
+        self._values.append(values)
+        self._prev = (counts[-1], values[-1])
 
     def build(self) -> PiecewiseDensity:
-        f = PiecewiseDensity()
-        for seg in self._segments:
-            f.add(seg)
-        return f
+        if not self._counts:
+            return PiecewiseDensity()
+        counts = np.concatenate(self._counts)
+        values = np.concatenate(self._values)
+        return PiecewiseDensity.from_arrays(values[:-1], values[1:], np.diff(counts))
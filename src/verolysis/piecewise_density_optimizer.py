@@ -1,9 +1,15 @@
 import numpy as np
 import scipy
+import time
 import warnings
 from typing import Union
+from verolysis import instrument
 from verolysis.piecewise_density import PiecewiseDensity, Segment
 
+# A warm start is already close to the solution, so the interior-point
+# method can start with a small barrier instead of first working its way in
+_WARM_OPTIONS = dict(initial_barrier_parameter=1e-6, initial_barrier_tolerance=1e-6)
+
 
 class PiecewiseDensityOptimizer:
     """Optimizing builder for PiecewiseDensity"""
@@ -24,28 +30,67 @@ class PiecewiseDensityOptimizer:
         self._places.sort()
         self._opt_params = None
 
-    def optimize(self) -> scipy.optimize.OptimizeResult:
+    def optimize(self, hint=None) -> scipy.optimize.OptimizeResult:
+        """
+        Fit the fringes
+
+        The hint, if given, is the hint of an earlier result for a similar
+        problem, e.g., the same bracket in another year. It is the solution
+        relative to the left fringe, so it carries over between brackets of
+        different scale. A three-parameter problem starts from it, with a
+        small initial barrier, and the result has warm_start set. The
+        one-parameter search is cheaper than any use of the hint, so there
+        it is ignored.
+        """
+        rec = instrument.active()
+        if rec is not None:
+            start = time.perf_counter()
         fr = self._require_fringe_condition()
         if fr.left_coeff < 0.5:
-            x0 = fr.init3()
+            warm = hint is not None and len(hint) == 3 and np.all(np.isfinite(hint))
+            x0 = fr.clip3(fr.absolute(hint)) if warm else fr.init3()
             bounds = fr.bounds3()
             constraints = fr.constraints3()
+            options = _WARM_OPTIONS if warm else {}
+            opt = self._optimize(x0, bounds, constraints, options)
+            opt.warm_start = warm
         else:
-            x0 = fr.init1()
-            bounds = fr.bounds1()
-            constraints = None
-        opt = self._optimize(x0, bounds, constraints)
+            opt = self._optimize1(fr.bracket1())
+        opt.hint = fr.relative(opt.x)
         if opt.success:
             self._x = opt.x
+        if rec is not None:
+            rec.record(
+                "optimize",
+                branch="init3" if fr.left_coeff < 0.5 else "init1",
+                time=time.perf_counter() - start,
+                nit=opt.nit,
+                nfev=opt.nfev,
+                score=float(opt.fun),
+                success=bool(opt.success),
+                warm_start=opt.warm_start,
+            )
         return opt
 
-    def build(self):
-        f = PiecewiseDensity()
-        for seg in self._full_segments():
-            f.add(seg)
-        return f
+    def build(self) -> PiecewiseDensity:
+        """
+        Density of the fitted segments
+
+        The segments run between consecutive places, so they are built
+        directly from the place arrays. Only repeated values, which are point
+        masses, need a merge to put them in order.
+        """
+        fractiles, values = np.transpose(self._full_places())
+        f = PiecewiseDensity.from_arrays(
+            values[:-1], values[1:], self._N * np.diff(fractiles)
+        )
+        if np.all(values[1:] > values[:-1]):
+            return f
+        return PiecewiseDensity.merge([f])
 
-    def _optimize(self, x0, bounds, constraints) -> scipy.optimize.OptimizeResult:
+    def _optimize(
+        self, x0, bounds, constraints, options: dict | None = None
+    ) -> scipy.optimize.OptimizeResult:
         warnings.filterwarnings(
             "ignore",
             message="delta_grad == 0.0. Check if the approximated function is linear.",
@@ -53,14 +98,49 @@ class PiecewiseDensityOptimizer:
         opt = scipy.optimize.minimize(
             self._score,
             x0,
+            jac=self._jac,
+            hess=self._hess,
             method="trust-constr",
             bounds=bounds,
             constraints=constraints,
-            options=dict(maxiter=1_000_000),
+            options=dict(maxiter=1_000_000, **(options or {})),
         )
         warnings.resetwarnings()
         return opt
 
+    def _optimize1(self, bracket: tuple[float, float]) -> scipy.optimize.OptimizeResult:
+        """
+        Fast path for the one-parameter problem
+
+        The minimum is known to lie within the bracket, so a bounded scalar
+        search finds it without the overhead of trust-constr.
+        """
+        lo, hi = bracket
+        if lo == hi:
+            x = np.array([lo])
+            return scipy.optimize.OptimizeResult(
+                x=x,
+                fun=self._score1(x),
+                success=True,
+                status=0,
+                nit=0,
+                nfev=1,
+                warm_start=False,
+            )
+        opt = scipy.optimize.minimize_scalar(
+            lambda a: self._score1([a]), bounds=(lo, hi), method="bounded"
+        )
+        return scipy.optimize.OptimizeResult(
+            x=np.array([opt.x]),
+            fun=opt.fun,
+            success=opt.success,
+            status=opt.status,
+            message=opt.message,
+            nit=opt.nit,
+            nfev=opt.nfev,
+            warm_start=False,
+        )
+
     def _require_fringe_condition(self) -> "FringeCondition":
         if self._fringe_condition is None:
             self._fringe_condition = FringeCondition.for_optimizer(self)
@@ -89,32 +169,47 @@ class PiecewiseDensityOptimizer:
         fr = self._require_fringe_condition()
         return fr.score_left3(x) + fr.score_right(*fr(x))
 
+    def _jac(self, x) -> np.ndarray:
+        fr = self._require_fringe_condition()
+        b, _ = fr(x)
+        d1, _ = fr.dscore_right(b)
+        left = fr.grad_left1(x) if len(x) == 1 else fr.grad_left3(x)
+        return left + d1 * fr.grad_b(x)
+
+    def _hess(self, x) -> np.ndarray:
+        fr = self._require_fringe_condition()
+        b, _ = fr(x)
+        d1, d2 = fr.dscore_right(b)
+        gb = fr.grad_b(x)
+        left = fr.hess_left1(x) if len(x) == 1 else fr.hess_left3(x)
+        return left + d2 * np.outer(gb, gb) + d1 * fr.hess_b(x)
+
     def _fixed_sum(self):
         return np.sum([s.s for s in self._fixed_segments()])
 
-    def _full_segments(self):
+    def _full_places(self) -> list[tuple[float, float]]:
         assert self._x is not None
         if len(self._x) == 1:
-            return self._full_segments1()
+            return self._full_places1()
         assert len(self._x) == 3
-        return self._full_segments3()
+        return self._full_places3()
 
-    def _full_segments1(self):
+    def _full_places1(self):
         x = self._x
         a = x[0]
         b, _ = self._compute_b(x)
         left = (0.0, a)
         right = (1.0, b)
-        return self._segments([left] + self._places + [right])
+        return [left] + self._places + [right]
 
-    def _full_segments3(self):
+    def _full_places3(self):
         x = self._x
         a1, a0, n0 = x
         b, _ = self._compute_b(x)
         left0 = (0.0, a0)
         left1 = (n0 / self._N, a1)
         right = (1.0, b)
-        return self._segments([left0, left1] + self._places + [right])
+        return [left0, left1] + self._places + [right]
 
     def _fixed_segments(self):
         return self._segments(self._places)
@@ -197,12 +292,55 @@ class FringeCondition:
     def init3(self) -> list[float]:
         return [self.amid, self.amin, self.nL / 2]
 
+    def bracket1(self) -> tuple[float, float]:
+        """
+        Interval containing the minimum of the one-parameter score
+
+        The left score is zero where the left fringe is as wide as the first
+        fixed segment, and the right score where the right fringe is as wide
+        as the last one. Each is unimodal in a, so the minimum of their sum
+        lies between those two points.
+        """
+        wL = self.fixed[0].b - self.fixed[0].a
+        wR = self.fixed[-1].b - self.fixed[-1].a
+        aL = self.xL - wL
+        aR = (self.xR + wR - self.c) / self.ka
+        lo, hi = np.clip(sorted([aL, aR]), self.amin, self.amax)
+        return lo, hi
+
     def bounds1(self) -> list[tuple[float | None, float | None]]:
         return [(self.amin, self.amax)]
 
     def bounds3(self) -> list[tuple[float | None, float | None]]:
         return [(self.amin, self.xL), (self.amin, self.xL), (0.0, self.nL)]
 
+    def relative(self, x) -> np.ndarray:
+        """
+        Parameters relative to the left fringe
+
+        Left ends are measured leftwards from xL in widths of the first fixed
+        segment, and the count in units of nL.
+        """
+        u = np.array(x, dtype=np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            u[:2] = (self.xL - u[:2]) / (self.fixed[0].b - self.fixed[0].a)
+            u[2:] /= self.nL
+        return u
+
+    def absolute(self, u) -> np.ndarray:
+        """Inverse of relative"""
+        x = np.array(u, dtype=np.float64)
+        x[:2] = self.xL - x[:2] * (self.fixed[0].b - self.fixed[0].a)
+        x[2:] *= self.nL
+        return x
+
+    def clip3(self, x) -> np.ndarray:
+        """Nearest point to x that is within bounds3 and constraints3"""
+        lo, hi = np.array(self.bounds3(), dtype=np.float64).T
+        x = np.clip(x, lo, hi)
+        x[1] = min(x[1], x[0])
+        return x
+
     def constraints3(self) -> list[scipy.optimize.LinearConstraint]:
         # a1 - a0 >= 0
         return scipy.optimize.LinearConstraint([[1, -1, 0]], lb=0.0)
@@ -221,6 +359,53 @@ class FringeCondition:
         b3 = self.fixed[-1].a
         return self._score_eq(b - b2, b2 - b3)
 
+    def grad_b(self, x) -> np.ndarray:
+        """Gradient of b with respect to x"""
+        if len(x) == 1:
+            return np.array([self.ka])
+        a1, a0, n0 = x
+        return np.array([self.ka, self.kn0a0 * n0, self.kn0 + self.kn0a0 * a0])
+
+    def hess_b(self, x) -> np.ndarray:
+        """Hessian of b with respect to x"""
+        h = np.zeros((len(x), len(x)))
+        if len(x) == 3:
+            h[1, 2] = h[2, 1] = self.kn0a0
+        return h
+
+    def grad_left1(self, x: np.ndarray) -> np.ndarray:
+        a1 = x[0]
+        a2 = self.fixed[0].a
+        a3 = self.fixed[0].b
+        _, g, _ = self._score_eq_derivs(a3 - a2, a2 - a1)
+        return np.array([-g[1]])
+
+    def hess_left1(self, x: np.ndarray) -> np.ndarray:
+        a1 = x[0]
+        a2 = self.fixed[0].a
+        a3 = self.fixed[0].b
+        _, _, h = self._score_eq_derivs(a3 - a2, a2 - a1)
+        return np.array([[h[1, 1]]])
+
+    def grad_left3(self, x: np.ndarray) -> np.ndarray:
+        g = np.zeros(3)
+        g[0] = self.grad_left1(x)[0]
+        g[2] = 2 * x[2] / self.nL**2
+        return g
+
+    def hess_left3(self, x: np.ndarray) -> np.ndarray:
+        h = np.zeros((3, 3))
+        h[0, 0] = self.hess_left1(x)[0, 0]
+        h[2, 2] = 2 / self.nL**2
+        return h
+
+    def dscore_right(self, b: float) -> tuple[float, float]:
+        """First and second derivative of score_right with respect to b"""
+        b2 = self.fixed[-1].b
+        b3 = self.fixed[-1].a
+        _, g, h = self._score_eq_derivs(b - b2, b2 - b3)
+        return g[0], h[0, 0]
+
     def _score_eq(self, a: float, b: float) -> float:
         if a == 0 or b == 0:
             return 1.0
@@ -228,6 +413,25 @@ class FringeCondition:
             r = min(a, b) / max(a, b)
             return (r - 1) ** 2
 
+    def _score_eq_derivs(
+        self, a: float, b: float
+    ) -> tuple[float, np.ndarray, np.ndarray]:
+        """Value, gradient and Hessian of _score_eq with respect to (a, b)"""
+        if a == 0 or b == 0:
+            return 1.0, np.zeros(2), np.zeros((2, 2))
+        if a <= b:
+            r = a / b
+            dr = np.array([1 / b, -a / b**2])
+            ddr = np.array([[0.0, -1 / b**2], [-1 / b**2, 2 * a / b**3]])
+        else:
+            r = b / a
+            dr = np.array([-b / a**2, 1 / a])
+            ddr = np.array([[2 * b / a**3, -1 / a**2], [-1 / a**2, 0.0]])
+        value = (r - 1) ** 2
+        grad = 2 * (r - 1) * dr
+        hess = 2 * np.outer(dr, dr) + 2 * (r - 1) * ddr
+        return value, grad, hess
+
     @staticmethod
     def for_optimizer(opt: PiecewiseDensityOptimizer) -> "FringeCondition":
         N = opt._N
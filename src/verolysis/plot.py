@@ -1,5 +1,10 @@
+import os
+from typing import Hashable, Mapping
+
 from matplotlib import pyplot as plt
 from matplotlib.axes import Axes
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 from matplotlib.ticker import FuncFormatter
 import numpy as np
 
@@ -12,11 +17,90 @@ def plot(what, *args, **kwargs):
 
 
 def plot_density(f: PiecewiseDensity, *args, **kwargs) -> None:
+    """
+    Plot a density as a step curve
+
+    The curve is a single artist. When the visible window holds more
+    segments than the axis has pixels across, it is downsampled to one step
+    per pixel, each the average height over that pixel. Pass style="bar" for
+    one bar per segment instead.
+    """
     ax = prepare_axis(**kwargs)
-    ax.bar(f.va, f.vh, f.vw, align="edge")
+    if kwargs.get("style", "stairs") == "bar":
+        ax.bar(f.va, f.vh, f.vw, align="edge")
+    elif not f.empty:
+        lo = kwargs.get("xmin", 0)
+        hi = kwargs.get("xmax", None)
+        hi = f.xmax if hi is None else hi
+        pixels = kwargs.get("pixels", None)
+        if pixels is None:
+            pixels = max(int(ax.get_window_extent().width), 1)
+        edges, heights = _stairs(f, lo, hi, pixels)
+        if len(heights) > 0:
+            ax.stairs(heights, edges, fill=True)
     _set_limits(ax, f, **kwargs)
 
 
+def plot_grid(
+    densities: Mapping[tuple[int, Hashable], PiecewiseDensity],
+    path: str | os.PathLike | None = None,
+    fig: Figure | None = None,
+    **kwargs,
+) -> Figure:
+    """
+    Small multiples of densities keyed by (year, group)
+
+    Each year is a column and each group a row, all on shared axes with one
+    shared x formatter. A given figure is cleared and reused. With a path,
+    the figure is also written to that file; if no figure is given, it is
+    then drawn on an Agg canvas without pyplot, so this works headless.
+    """
+    assert len(densities) > 0
+
+    years = sorted({year for year, _ in densities})
+    groups = list(dict.fromkeys(group for _, group in densities))
+    if fig is not None:
+        fig.clear()
+    elif path is not None:
+        fig = Figure(figsize=kwargs.get("figsize", None))
+        FigureCanvasAgg(fig)
+    else:
+        fig = plt.figure(figsize=kwargs.get("figsize", None))
+    axes = fig.subplots(
+        len(groups), len(years), sharex=True, sharey=True, squeeze=False
+    )
+
+    keys = [key for key, f in densities.items() if not f.empty]
+    fs = [densities[key] for key in keys]
+    lo = kwargs.get("xmin", 0)
+    hi = kwargs.get("xmax", None)
+    if hi is None:
+        hi = max((f.xmax for f in fs), default=lo)
+    pixels = kwargs.get("pixels", None)
+    if pixels is None:
+        pixels = max(int(fig.get_figwidth() * fig.dpi / len(years)), 1)
+    for (year, group), f in zip(keys, fs):
+        edges, heights = _stairs(f, lo, hi, pixels)
+        ax = axes[groups.index(group), years.index(year)]
+        if len(heights) > 0:
+            ax.stairs(heights, edges, fill=True)
+    for ax in axes.flat:
+        _set_grid(ax, **kwargs)
+    for c, year in enumerate(years):
+        axes[0, c].set_title(str(year))
+    for r, group in enumerate(groups):
+        axes[r, 0].set_ylabel(str(group))
+
+    tops = [h for h in map(_guess_height, fs) if h is not None]
+    ymax = kwargs.get("ymax", max(tops, default=None))
+    _set_xformatter(axes[0, 0])
+    axes[0, 0].set_xlim(lo, hi)
+    axes[0, 0].set_ylim(kwargs.get("ymin", 0), ymax)
+    if path is not None:
+        fig.savefig(path)
+    return fig
+
+
 def prepare_axis(**kwargs) -> Axes:
     ax = _get_axis(**kwargs)
     _set_grid(ax, **kwargs)
@@ -24,25 +108,52 @@ def prepare_axis(**kwargs) -> Axes:
     return ax
 
 
-def _set_limits(ax: Axes, f: PiecewiseDensity, **kwargs) -> None:
+def _set_limits(axis: Axes, f: PiecewiseDensity, **kwargs) -> None:
     xmin = kwargs.get("xmin", 0)
     xmax = kwargs.get("xmax", None)
     ymin = kwargs.get("ymin", 0)
     ymax = kwargs.get("ymax", _guess_height(f))
-    ax.set_xlim(xmin, xmax)
-    ax.set_ylim(ymin, ymax)
+    axis.set_xlim(xmin, xmax)
+    axis.set_ylim(ymin, ymax)
 
 
-def _set_grid(ax, **kwargs) -> None:
+def _set_grid(axis, **kwargs) -> None:
     grid = kwargs.get("grid", True)
-    ax.grid(ax)
+    axis.grid(grid)
 
 
-def _guess_height(f) -> float:
-    if len(f) > 100:
-        return sorted(f.vh)[-10] * 1.1
+def _guess_height(f) -> float | None:
+    h = f.vh[np.isfinite(f.vh)]
+    if len(h) > 100:
+        return np.partition(h, -10)[-10] * 1.1
+    elif len(h) > 0:
+        return np.max(h) * 1.1
+    else:
+        return None
+
+
+def _stairs(
+    f: PiecewiseDensity, lo: float, hi: float, pixels: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Step edges and heights of f over [lo, hi]
+
+    Point masses are left out. If the window holds more segments than there
+    are pixels, the steps are instead a uniform grid of that many pixels.
+    """
+    wide = f.vw > 0
+    g = PiecewiseDensity.from_arrays(f.va[wide], f.vb[wide], f.vn[wide])
+    if g.empty or hi <= lo:
+        return np.array([lo]), np.empty(0)
+    i = np.searchsorted(g.vb, lo, side="right")
+    j = np.searchsorted(g.va, hi, side="left")
+    if j - i <= pixels:
+        inside = np.concatenate([g.va[i:j], g.vb[i:j]])
+        edges = np.unique(np.clip(np.concatenate([[lo, hi], inside]), lo, hi))
     else:
-        return np.max(f.vh) * 1.1
+        edges = np.linspace(lo, hi, pixels + 1)
+    counts = np.diff(g._cumulative(edges, 0, False))
+    return edges, counts / np.diff(edges)
 
 
 def _set_xformatter(ax) -> None:
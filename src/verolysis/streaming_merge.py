@@ -0,0 +1,214 @@
+import heapq
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+import numpy as np
+
+from verolysis.piecewise_density import (
+    _HEADER,
+    _MAGIC,
+    _VERSION,
+    PiecewiseDensity,
+    Segment,
+)
+
+
+Sink = Callable[[np.ndarray, np.ndarray, np.ndarray], None]
+
+
+class StreamingMerger:
+    """
+    Sum of many densities, emitted left to right with bounded memory
+
+    Densities are added one at a time, and merged segments are passed to the
+    sink as (a, b, n) arrays, in order, as soon as no later input can change
+    them. The result is the same as PiecewiseDensity.merge of all inputs.
+
+    With ordered inputs, each added density must start no further left than
+    the one before, and everything left of its start is final. Pending
+    segments are merged and flushed whenever there are more than
+    buffer_segments of them.
+
+    Otherwise, inputs can come in any order. Pending segments are then
+    merged into sorted runs of at most buffer_segments, spilled to temporary
+    files, and the runs are swept together on close, a chunk at a time, with
+    a heap picking the run that is furthest behind.
+    """
+
+    def __init__(
+        self,
+        sink: Sink,
+        ordered: bool = False,
+        buffer_segments: int = 1_000_000,
+        tmpdir: str | os.PathLike | None = None,
+    ):
+        self._sink = sink
+        self._ordered = ordered
+        self._buffer_segments = buffer_segments
+        self._tmpdir = tmpdir
+        self._parts: list[PiecewiseDensity] = []
+        self._size = 0
+        self._watermark = -np.inf
+        self._runs: list[Path] = []
+        self._dir: tempfile.TemporaryDirectory | None = None
+        self._closed = False
+
+    def __enter__(self) -> "StreamingMerger":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if exc[0] is None:
+            self.close()
+        else:
+            # Nothing more is emitted, and the runs are deleted
+            self._closed = True
+            if self._dir is not None:
+                self._dir.cleanup()
+
+    def add(self, f: PiecewiseDensity | Segment) -> None:
+        assert not self._closed
+        if isinstance(f, Segment):
+            f = PiecewiseDensity.from_arrays([f.a], [f.b], [f.n])
+        if f.empty:
+            return
+        if self._ordered:
+            assert f.xmin >= self._watermark, "inputs are not ordered by xmin"
+            self._watermark = f.xmin
+        self._parts.append(f)
+        self._size += len(f)
+        if self._size > self._buffer_segments:
+            if self._ordered:
+                self._flush(self._watermark)
+            else:
+                self._spill()
+
+    def close(self) -> None:
+        """Emit everything that is still pending"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._runs:
+            assert self._dir is not None
+            self._spill()
+            self._sweep_runs()
+            self._dir.cleanup()
+        else:
+            self._flush(np.inf)
+
+    def _flush(self, watermark: float) -> None:
+        """Emit the merged segments that end at or before the watermark"""
+        if not self._parts:
+            return
+        f = PiecewiseDensity.merge(self._parts)
+        wide = f.vb > f.va
+        final = np.where(wide, f.vb <= watermark, f.va < watermark)
+        k = len(f) if final.all() else int(np.argmin(final))
+        if k > 0:
+            self._sink(f.va[:k], f.vb[:k], f.vn[:k])
+        rest = PiecewiseDensity.from_arrays(f.va[k:], f.vb[k:], f.vn[k:])
+        self._parts = [] if rest.empty else [rest]
+        self._size = len(rest)
+
+    def _spill(self) -> None:
+        """Write the pending segments to disk as one sorted run"""
+        if not self._parts:
+            return
+        if self._dir is None:
+            self._dir = tempfile.TemporaryDirectory(dir=self._tmpdir)
+        f = PiecewiseDensity.merge(self._parts)
+        path = Path(self._dir.name) / f"run{len(self._runs)}.npy"
+        np.save(path, np.stack([f.va, f.vb, f.vn]))
+        self._runs.append(path)
+        self._parts = []
+        self._size = 0
+
+    def _sweep_runs(self) -> None:
+        runs = [np.load(path, mmap_mode="r") for path in self._runs]
+        chunk = max(self._buffer_segments // (2 * len(runs)), 1)
+        pos = [0] * len(runs)
+        # Each run is in the heap by the end of its last loaded segment
+        heap = [(-np.inf, r) for r in range(len(runs))]
+        while heap:
+            _, r = heapq.heappop(heap)
+            v = np.array(runs[r][:, pos[r] : pos[r] + chunk])
+            pos[r] += v.shape[1]
+            self._parts.append(PiecewiseDensity.from_arrays(v[0], v[1], v[2]))
+            self._size += v.shape[1]
+            if pos[r] < runs[r].shape[1]:
+                heapq.heappush(heap, (float(v[1, -1]), r))
+            watermark = heap[0][0] if heap else np.inf
+            if self._size > self._buffer_segments or watermark == np.inf:
+                self._flush(watermark)
+        del runs
+
+
+def stream_merge(
+    parts: Iterable[PiecewiseDensity | Segment],
+    ordered: bool = False,
+    buffer_segments: int = 1_000_000,
+) -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Merged segments of all parts, as (a, b, n) chunks from left to right"""
+    chunks = []
+    merger = StreamingMerger(
+        lambda a, b, n: chunks.append((a, b, n)), ordered, buffer_segments
+    )
+    with merger:
+        for part in parts:
+            merger.add(part)
+            yield from chunks
+            chunks.clear()
+    yield from chunks
+
+
+class ArraySink:
+    """Sink that collects the segments in memory"""
+
+    def __init__(self):
+        self._chunks: list[tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+
+    def __call__(self, a: np.ndarray, b: np.ndarray, n: np.ndarray) -> None:
+        self._chunks.append((a, b, n))
+
+    def density(self) -> PiecewiseDensity:
+        if not self._chunks:
+            return PiecewiseDensity()
+        return PiecewiseDensity.from_arrays(
+            *(np.concatenate(v) for v in zip(*self._chunks))
+        )
+
+
+class FileSink:
+    """
+    Sink that writes the segments to a file, in the format of save
+
+    The columns are streamed to temporary files and joined on close, so that
+    only one chunk is held in memory. The result can be memory-mapped with
+    PiecewiseDensity.load.
+    """
+
+    def __init__(self, path: str | os.PathLike):
+        self._path = Path(path)
+        self._dir = tempfile.TemporaryDirectory(dir=self._path.parent)
+        self._columns = [
+            open(Path(self._dir.name) / name, "wb") for name in ("a", "b", "n")
+        ]
+        self._count = 0
+
+    def __call__(self, a: np.ndarray, b: np.ndarray, n: np.ndarray) -> None:
+        for column, v in zip(self._columns, (a, b, n)):
+            column.write(np.asarray(v, dtype="<f8").tobytes())
+        self._count += len(a)
+
+    def close(self) -> None:
+        tmp = self._path.with_name(self._path.name + ".tmp")
+        with open(tmp, "wb") as file:
+            file.write(_HEADER.pack(_MAGIC, _VERSION, self._count))
+            for column in self._columns:
+                column.close()
+                with open(column.name, "rb") as src:
+                    shutil.copyfileobj(src, file)
+        os.replace(tmp, self._path)
+        self._dir.cleanup()
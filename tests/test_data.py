@@ -1,4 +1,5 @@
 import pandas as pd
+import pytest
 import verolysis
 
 
@@ -16,3 +17,120 @@ def test_data_group_filter():
 
     df = verolysis.data.ansiotulot(2022, 2)
     assert len(df.Tulonsaajaryhmä.unique() == 1)
+
+
+class FakeTable:
+    """Stand-in for the tulot_101.px table of the PxWeb API"""
+
+    def __init__(self):
+        self.queries = []
+
+    def query(self, spec, cache=None):
+        self.queries.append(spec)
+        rows = []
+        for year in _as_list(spec["Verovuosi"]):
+            for part in _as_list(spec["Erä"]):
+                for group in ("Y", "1", "2"):
+                    wanted = spec["Tulonsaajaryhmä"]
+                    if wanted != "*" and group not in _as_list(wanted):
+                        continue
+                    for bracket in ("SS", "1", "2", "3"):
+                        rows.append(
+                            dict(
+                                Verovuosi=str(year),
+                                Tulonsaajaryhmä=group,
+                                Tuloluokka=bracket,
+                                Erä=part,
+                                N=100.0,
+                                Mean=1000.0 * len(rows),
+                            )
+                        )
+        return pd.DataFrame.from_records(rows)
+
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+class FakeClient:
+    def __init__(self):
+        self.tables = {}
+
+    def table(self, database, name):
+        return self.tables.setdefault((database, name), FakeTable())
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(verolysis.data, "_client", lambda: client)
+    yield client
+    verolysis.data.configure()
+
+
+def test_store(fake_client, tmp_path):
+    verolysis.data.configure(tmp_path)
+    df = verolysis.data.ansiotulot(2022)
+    assert len(df) == 12
+    assert df.Tulonsaajaryhmä.dtype == "category"
+    assert (tmp_path / "tulot_101.2022.HVT_TULOT_70.parquet").exists()
+
+    df = verolysis.data.ansiotulot(2022, 2)
+    assert list(df.Tulonsaajaryhmä.unique()) == ["2"]
+    assert list(df.Tuloluokka) == ["SS", "1", "2", "3"]
+    assert len(fake_client.tables["Vero", "tulot_101.px"].queries) == 1
+
+
+def test_store_offline(fake_client, tmp_path):
+    verolysis.data.configure(tmp_path)
+    verolysis.data.palkkatulot(2021)
+
+    verolysis.data.configure(tmp_path, offline=True)
+    df = verolysis.data.palkkatulot(2021, "Y")
+    assert len(df) == 4
+    with pytest.raises(verolysis.data.OfflineError):
+        verolysis.data.palkkatulot(2020)
+    assert len(fake_client.tables["Vero", "tulot_101.px"].queries) == 1
+
+
+def test_load(fake_client):
+    df = verolysis.data.load(range(2015, 2023), groups=[1, "Y"], years_per_query=3)
+    queries = fake_client.tables["Vero", "tulot_101.px"].queries
+    assert len(queries) == 3
+    assert sorted(len(q["Verovuosi"]) for q in queries) == [2, 3, 3]
+    assert all(q["Tulonsaajaryhmä"] == ["1", "Y"] for q in queries)
+
+    assert len(df) == 8 * 2 * 2 * 4
+    assert list(df.Verovuosi.unique()) == list(range(2015, 2023))
+    assert set(df.Tulonsaajaryhmä) == {"1", "Y"}
+    assert set(df.Erä) == {"HVT_TULOT_70", "HVT_TULOT_80"}
+
+
+def test_load_with_store(fake_client, tmp_path):
+    verolysis.data.configure(tmp_path)
+    verolysis.data.ansiotulot(2021)
+    df = verolysis.data.load([2021, 2022], groups=[2])
+    queries = fake_client.tables["Vero", "tulot_101.px"].queries
+    assert len(queries) == 2
+    assert queries[1]["Verovuosi"] == [2021, 2022]
+    assert len(df) == 2 * 2 * 4
+    assert len(verolysis.data.palkkatulot(2022)) == 12
+
+    verolysis.data.configure(tmp_path, offline=True)
+    assert len(verolysis.data.load([2021, 2022])) == 2 * 2 * 12
+    assert len(queries) == 2
+    with pytest.raises(verolysis.data.OfflineError):
+        verolysis.data.load([2020])
+
+
+def test_store_schema(fake_client, tmp_path):
+    verolysis.data.configure(tmp_path)
+    first = verolysis.data.ansiotulot(2021)
+    verolysis.data.load([2022], [verolysis.data.ANSIOTULOT])
+    second = verolysis.data.ansiotulot(2022)
+    assert first.dtypes.to_dict() == second.dtypes.to_dict()
+    assert first.Verovuosi.dtype == int
+
+    assert verolysis.data.load([]).empty
+    verolysis.data.configure()
+    assert verolysis.data.load([2022], groups=["none"]).empty
@@ -0,0 +1,174 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+from numpy.testing import assert_allclose
+
+from verolysis import income_brackets
+from verolysis.density_cache import DensityCache
+from verolysis.piecewise_density_optimizer import PiecewiseDensityOptimizer
+
+
+FRACTILES = dict(income_brackets._FRAC_KEYS)
+
+
+def make_table(rows: int = 40, seed: int = 0) -> pd.DataFrame:
+    """Synthetic income bracket table shaped like tulot_101.px"""
+    rng = np.random.default_rng(seed)
+    records = []
+    edges = np.concatenate([[0.0], np.cumsum(rng.uniform(2_000, 8_000, rows))])
+    for i in range(rows):
+        lo, hi = edges[i], edges[i + 1]
+        N = float(rng.integers(1_000, 100_000))
+        x = lo + (hi - lo) * rng.beta(2, 2, 10_000)
+        record = dict(
+            Tulonsaajaryhmä="Y",
+            Tuloluokka=str(i + 1),
+            N=N,
+            Mean=float(np.mean(x)),
+        )
+        for key, frac in FRACTILES.items():
+            record[key] = float(np.quantile(x, frac))
+        if i % 5 == 1:
+            for key in ("P10", "P20", "P30", "P40", "P60", "P70", "P80", "P90"):
+                record[key] = np.nan
+        records.append(record)
+    # A bracket with no fractiles at all, and the total row
+    records.append(dict(Tulonsaajaryhmä="Y", Tuloluokka="X", N=10.0, Mean=5e5))
+    records.append(dict(Tulonsaajaryhmä="Y", Tuloluokka="SS", N=1.0, Mean=1.0))
+    return pd.DataFrame.from_records(records)
+
+
+def test_to_density():
+    df = make_table()
+    f = income_brackets.to_density(df)
+    rows = df[df.Tuloluokka != "SS"]
+    assert_allclose(f.count(), rows.N.sum())
+    assert_allclose(f.sum(), (rows.N * rows.Mean).sum())
+    assert f.count(5e5, 5e5) == 10
+
+
+def test_to_density_batch():
+    df = make_table()
+    f = income_brackets.to_density(df)
+    g = income_brackets.to_density(df, batch=True)
+    assert_allclose(g.count(), f.count())
+    assert_allclose(g.sum(), f.sum())
+    x = np.linspace(0, 300_000, 301)
+    assert_allclose(g.count_many(None, x), f.count_many(None, x), rtol=1e-3)
+
+    for kwargs in [dict(cache=object()), dict(warm_start={}), dict(workers=2)]:
+        with pytest.raises(AssertionError):
+            income_brackets.to_density(df, batch=True, **kwargs)
+
+
+def test_to_density_parallel():
+    df = make_table()
+    f = income_brackets.to_density(df)
+    with ThreadPoolExecutor(3) as executor:
+        g = income_brackets.to_density(df, executor=executor, chunk_size=7)
+    h = income_brackets.to_density(df, workers=2)
+    for other in (g, h):
+        assert list(other.va) == list(f.va)
+        assert list(other.vb) == list(f.vb)
+        assert list(other.vn) == list(f.vn)
+
+
+def test_to_density_cache(tmp_path, monkeypatch):
+    df = make_table()
+    cache = DensityCache(tmp_path / "cache")
+    f = income_brackets.to_density(df, cache=cache)
+    assert len(list((tmp_path / "cache").glob("*.npy"))) == len(df) - 2
+
+    def fail(self):
+        raise AssertionError("optimizer called on a warm cache")
+
+    monkeypatch.setattr(PiecewiseDensityOptimizer, "optimize", fail)
+    g = income_brackets.to_density(df, cache=cache)
+    assert list(g.va) == list(f.va)
+    assert list(g.vn) == list(f.vn)
+
+
+def test_density_cache_eviction(tmp_path):
+    f = income_brackets.to_density(make_table(3))
+    entry = 128 + 3 * 8 * len(f)
+    cache = DensityCache(tmp_path, max_bytes=2 * entry)
+    keys = [cache.key(i, 1.0, [(1.0, 0.5)], 0.0) for i in range(3)]
+    assert len(set(keys)) == 3
+    cache.put(keys[0], f)
+    cache.put(keys[1], f)
+    os.utime(tmp_path / f"{keys[0]}.npy", (0, 0))
+    os.utime(tmp_path / f"{keys[1]}.npy", (1, 1))
+    assert cache.get(keys[0]) is not None
+    cache.put(keys[2], f)
+    assert cache.get(keys[1]) is None
+    assert list(cache.get(keys[0]).va) == list(f.va)
+    assert cache.get(keys[2]) is not None
+
+
+def test_density_cache_scans(tmp_path, monkeypatch):
+    f = income_brackets.to_density(make_table(3))
+    entry = 128 + 3 * 8 * len(f)
+    cache = DensityCache(tmp_path, max_bytes=4 * entry)
+    scans = []
+    evict = cache._evict
+    monkeypatch.setattr(cache, "_evict", lambda: scans.append(1) or evict())
+    for i in range(6):
+        cache.put(cache.key(i, 1.0, [(1.0, 0.5)], 0.0), f)
+    assert len(scans) == 3
+    assert len(list(tmp_path.glob("*.npy"))) == 4
+
+    def evicted(path, *args):
+        raise FileNotFoundError(path)
+
+    key = cache.key(5, 1.0, [(1.0, 0.5)], 0.0)
+    monkeypatch.setattr(os, "utime", evicted)
+    assert cache.get(key) is None
+
+
+def test_to_density_from_arrays():
+    df = make_table()
+    f = income_brackets.to_density(df)
+    records = df.to_records(index=False)
+    arrow = pa.Table.from_pandas(df.astype({"Tuloluokka": "category"}))
+    for table in (records, arrow):
+        g = income_brackets.to_density(table)
+        assert list(g.va) == list(f.va)
+        assert list(g.vn) == list(f.vn)
+        g = income_brackets.to_density(table, batch=True)
+        assert_allclose(g.count(), f.count())
+
+
+def test_row_to_density():
+    df = make_table()
+    f = income_brackets.row_to_density(df.iloc[3])
+    g = income_brackets.to_density(df.iloc[3:4])
+    assert list(g.va) == list(f.va)
+    assert list(g.vn) == list(f.vn)
+
+
+def test_warm_start():
+    df = make_table()
+    warm_start = {}
+    f = income_brackets.to_density(df, warm_start=warm_start)
+    assert set(warm_start) == set(df.Tuloluokka) - {"X", "SS"}
+
+    later = df.copy()
+    columns = [key for key in FRACTILES] + ["Mean"]
+    later[columns] *= 1.02
+    hints = dict(warm_start)
+    g = income_brackets.to_density(later, warm_start=warm_start)
+    assert_allclose(g.count(), f.count())
+    assert_allclose(g.sum(), 1.02 * f.sum())
+    assert warm_start.keys() == hints.keys()
+
+    # A fit with no usable hint keeps the earlier one
+    flat = pd.DataFrame(
+        [dict(Tuloluokka="1", N=100.0, Mean=1.0, Q1=1.0, P50=1.0, Q3=1.2)]
+    )
+    before = warm_start["1"]
+    income_brackets.to_density(flat, warm_start=warm_start)
+    assert warm_start["1"] is before
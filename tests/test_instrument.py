@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from verolysis import income_brackets, instrument
+from verolysis.instrument import Recorder
+from verolysis.piecewise_density import PiecewiseDensity, Segment
+
+from test_income_brackets import make_table
+
+
+def test_records_rows_and_merges():
+    df = make_table()
+    # The total row first, so that positions and brackets differ
+    df = pd.concat([df.iloc[-1:], df.iloc[:-1]], ignore_index=True)
+    seen = []
+    with Recorder(callback=lambda kind, record: seen.append(kind)) as rec:
+        assert instrument.active() is rec
+        f = income_brackets.to_density(df)
+    assert instrument.active() is None
+
+    rows = rec.to_frame("optimize")
+    assert len(rows) == 40
+    assert list(rows.bracket) == [str(i + 1) for i in range(40)]
+    assert set(rows.branch) <= {"init1", "init3"}
+    assert (rows.time > 0).all()
+    assert rows.success.all()
+    assert np.isfinite(rows.score).all()
+    assert (rows.nfev >= 1).all()
+
+    merges = rec.to_frame("merge")
+    assert merges.segments_out.iloc[-1] == len(f)
+    assert (merges.segments_in >= 1).all()
+    assert seen.count("optimize") == 40
+    assert seen.count("merge") == len(merges)
+
+
+def test_off_by_default_and_nested():
+    f = PiecewiseDensity()
+    f.add(Segment(0, 1, 1))
+    with Recorder() as outer:
+        with Recorder() as inner:
+            f.add(Segment(0, 2, 1))
+        assert instrument.active() is outer
+        f.add(Segment(0, 3, 1))
+    assert len(inner.records["merge"]) == 1
+    assert outer.to_frame("merge").segments_out.tolist() == [3]
+    assert outer.to_frame("optimize").empty
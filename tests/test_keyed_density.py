@@ -0,0 +1,60 @@
+import numpy as np
+from numpy.testing import assert_allclose
+
+from verolysis.keyed_density import KeyedDensity
+from verolysis.piecewise_density import PiecewiseDensity
+
+
+def random_part(rng):
+    k = rng.integers(1, 6)
+    x = np.sort(rng.choice(np.arange(0, 60), size=k + 1, replace=False)).astype(float)
+    n = rng.integers(1, 10, size=k).astype(float)
+    a, b = x[:-1].copy(), x[1:].copy()
+    if rng.random() < 0.3:
+        b[0] = a[0]
+    return PiecewiseDensity.merge([PiecewiseDensity.from_arrays(a, b, n)])
+
+
+def assert_same_density(f, g):
+    assert len(f) == len(g)
+    assert list(f.va) == list(g.va)
+    assert list(f.vb) == list(g.vb)
+    assert_allclose(f.vn, g.vn)
+
+
+def test_keyed_density_matches_rebuild():
+    rng = np.random.default_rng(3)
+    parts = {k: random_part(rng) for k in range(6)}
+    keyed = KeyedDensity(parts)
+    assert_same_density(keyed.density, PiecewiseDensity.merge(parts.values()))
+    keyed.density.count()
+
+    for step in range(60):
+        key = int(rng.integers(0, 9))
+        if key in parts and rng.random() < 0.3:
+            del parts[key]
+            keyed.remove(key)
+        else:
+            parts[key] = random_part(rng)
+            keyed.set(key, parts[key])
+        rebuilt = PiecewiseDensity.merge(parts.values())
+        assert_same_density(keyed.density, rebuilt)
+
+        # The patched index answers queries like a fresh one
+        x = np.linspace(-1, 61, 50)
+        assert_allclose(keyed.density.count_many(None, x), rebuilt.count_many(None, x))
+        assert_allclose(keyed.density.sum_many(x, None), rebuilt.sum_many(x, None))
+
+    assert set(keyed) == set(parts)
+    assert len(keyed) == len(parts)
+
+
+def test_restrict():
+    f = PiecewiseDensity.merge(
+        [PiecewiseDensity.from_arrays([0, 2, 2], [2, 2, 6], [4, 1, 8])]
+    )
+    for a, b in ((None, None), (1, 2), (1, 3), (2, 2), (2, 5), (3, None), (7, 8)):
+        g = f.restrict(a, b)
+        assert_allclose(g.count(), f.count(a, b))
+        assert_allclose(g.sum(), f.sum(a, b))
+    assert list(f.restrict(1, 3).va) == [1, 2, 2]
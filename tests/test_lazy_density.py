@@ -0,0 +1,57 @@
+import numpy as np
+from numpy.testing import assert_allclose
+
+from verolysis.instrument import Recorder
+from verolysis.lazy_density import LazyDensity
+from verolysis.piecewise_density import PiecewiseDensity, Segment
+
+
+def make_density(segments, seed):
+    rng = np.random.default_rng(seed)
+    x = np.sort(rng.uniform(0, 1e5, segments + 1))
+    f = PiecewiseDensity.from_arrays(x[:-1], x[1:], rng.uniform(1, 10, segments))
+    return f + Segment(x[segments // 2], x[segments // 2], 50.0)
+
+
+def test_queries_match_materialized():
+    f, g, h = (make_density(1_000, seed) for seed in range(3))
+    expr = 2 * (LazyDensity(f) + g) + h - 0.5 * LazyDensity(g)
+    full = expr.materialize()
+    reference = 2 * (f + g) + h - 0.5 * g
+    assert_allclose(full.count(), reference.count())
+
+    x = [0, 1e3, 2.5e4, 5e4, 9.9e4]
+    for a in [None, *x]:
+        assert_allclose(expr.count(a, None), full.count(a, None))
+        assert_allclose(expr.count(None, a), full.count(None, a), atol=1e-6)
+        assert_allclose(expr.mean(a, None), full.mean(a, None))
+        assert_allclose(expr.sum_above(a or 0), full.sum_above(a or 0))
+    for a in x[1:]:
+        assert_allclose(expr.pareto(a), full.pareto(a))
+    assert expr.pareto(0) == 1.0
+
+    for n in np.linspace(0, full.count(), 37):
+        assert_allclose(expr.icount(n), full.icount(n), rtol=1e-9)
+    assert expr.icount(-1) == full.xmin
+    assert expr.icount(full.count() + 1, right=-1) == -1
+
+
+def test_icount_merges_locally():
+    parts = [make_density(10_000, seed) for seed in range(10)]
+    expr = sum(LazyDensity(f) for f in parts)
+    assert len(expr.terms()) == 10
+    with Recorder() as rec:
+        x = expr.icount(expr.count() / 2)
+    merges = rec.to_frame("merge")
+    assert len(merges) == 1
+    assert merges.segments_in.iloc[0] <= 64
+    assert_allclose(x, PiecewiseDensity.merge(parts).icount(expr.count() / 2))
+
+
+def test_terms():
+    f = make_density(10, 0)
+    expr = LazyDensity(f) + f - LazyDensity(f)
+    assert [(w, g) for w, g in expr.terms()] == [(1.0, f)]
+    assert (LazyDensity(f) - f).empty
+    assert LazyDensity().empty
+    assert np.isnan(LazyDensity().mean())
@@ -0,0 +1,359 @@
+import mmap
+
+import numpy as np
+import pytest
+from numpy.testing import assert_almost_equal
+
+from verolysis.piecewise_density import PiecewiseDensity, Segment
+
+
+def make_density():
+    f = PiecewiseDensity()
+    f.add(Segment(0, 4, 8))
+    f.add(Segment(2, 6, 4))
+    f.add(Segment(3, 3, 5))
+    f.add(Segment(8, 10, 1))
+    return f
+
+
+def reference_count(f, a, b):
+    overlaps = [seg.overlap(a, b) for seg in f[:]]
+    return sum(o.n for o in overlaps if o)
+
+
+def reference_sum(f, a, b):
+    overlaps = [seg.overlap(a, b) for seg in f[:]]
+    return sum(o.s for o in overlaps if o)
+
+
+def test_array_storage():
+    f = make_density()
+    assert len(f) == 6
+    assert f[0] == Segment(0, 2, 4)
+    assert f[2] == Segment(3, 3, 5)
+    assert f[-1] == Segment(8, 10, 1)
+    assert f.xmin == 0
+    assert f.xmax == 10
+
+    assert f.va.dtype == np.float64
+    assert np.shares_memory(f.va, f._a)
+    assert not f.va.flags.writeable
+    assert list(f.vw) == [2, 1, 0, 1, 2, 2]
+    assert np.isinf(f.vh[2])
+    assert_almost_equal(f.vh[f.vw > 0], [2, 3, 3, 1, 0.5])
+
+
+def test_from_arrays():
+    a = np.array([0.0, 1.0, 3.0])
+    b = np.array([1.0, 2.0, 3.0])
+    n = np.array([1.0, 2.0, 3.0])
+    f = PiecewiseDensity.from_arrays(a, b, n)
+    assert np.shares_memory(f.va, a)
+    assert f[1] == Segment(1, 2, 2)
+    assert f.empty is False
+    assert PiecewiseDensity().empty
+
+
+def test_count_and_sum_match_segments():
+    f = make_density()
+    bounds = [None, -1, 0, 1, 2.5, 3, 3.5, 6, 7, 9, 10, 11]
+    for a in bounds:
+        for b in bounds:
+            assert_almost_equal(f.count(a, b), reference_count(f, a, b))
+            assert_almost_equal(f.sum(a, b), reference_sum(f, a, b))
+
+
+def test_icount():
+    f = make_density()
+    assert f.icount(-1) == 0
+    assert f.icount(-1, left=-5) == -5
+    assert f.icount(0) == 0
+    assert f.icount(2) == 1
+    assert f.icount(8) == 3
+    assert f.icount(10) == 3
+    assert f.icount(12) == 3
+    assert f.icount(13.5) == 3.5
+    assert f.icount(100) == 10
+    assert f.icount(100, right=20) == 20
+
+    e = PiecewiseDensity()
+    assert e.icount(-1, left=-5) == -5
+    assert e.icount(1, right=20) == 20
+    assert e.icount(1) is None
+    assert list(e.icount_many([-1, 0, 1], left=-5, right=20)) == [-5, 20, 20]
+
+
+def assimilate(segments, incoming):
+    """Reference: the original one-segment-at-a-time merge"""
+    if len(segments) == 0:
+        return [incoming]
+    result = []
+    for existing in segments:
+        if incoming is None:
+            result.append(existing)
+        else:
+            processed, incoming = Segment.merge(existing, incoming)
+            result += processed
+    if incoming:
+        result.append(incoming)
+    return result
+
+
+def random_density(rng, k):
+    x = np.sort(rng.choice(np.arange(0, 40), size=k + 1, replace=False))
+    f = PiecewiseDensity()
+    for a, b in zip(x[:-1], x[1:]):
+        if rng.random() < 0.3:
+            f.add(Segment(a, a, rng.integers(1, 10)))
+        elif rng.random() < 0.8:
+            f.add(Segment(a, b, rng.integers(1, 10)))
+    return f
+
+
+def test_merge_matches_assimilate():
+    rng = np.random.default_rng(1)
+    for _ in range(50):
+        parts = [random_density(rng, rng.integers(1, 8)) for _ in range(3)]
+        reference = []
+        for part in parts:
+            for seg in part[:]:
+                reference = assimilate(reference, seg)
+
+        merged = PiecewiseDensity.merge(parts)
+        assert len(merged) == len(reference)
+        for seg, ref in zip(merged[:], reference):
+            assert seg.a == ref.a
+            assert seg.b == ref.b
+            assert_almost_equal(seg.n, ref.n)
+
+
+def test_merge_edge_cases():
+    assert PiecewiseDensity.merge([]).empty
+    assert PiecewiseDensity.merge([PiecewiseDensity()]).empty
+
+    f = PiecewiseDensity.merge([Segment(1, 1, 2), Segment(1, 1, 3), Segment(0, 1, 1)])
+    assert f[:] == [Segment(0, 1, 1), Segment(1, 1, 5)]
+
+    f = PiecewiseDensity.merge([Segment(0, 3, 0.3), Segment(0.1, 0.2, 1e6)])
+    assert f[0] == Segment(0, 0.1, 0.1 * 0.3 / 3)
+    assert_almost_equal(f.count(), 1e6 + 0.3)
+
+    # Exact counts after a gap, and many overlapping parts
+    f = PiecewiseDensity.merge(
+        [Segment(0, 1, 1e12), Segment(0.5, 1, 3e11), Segment(2, 3, 1e-6)]
+    )
+    assert f[-1] == Segment(2, 3, 1e-6)
+    x = np.linspace(0, 1000, 11)
+    part = PiecewiseDensity.from_arrays(x[:-1], x[1:], np.ones(10))
+    merged = PiecewiseDensity.merge(part.shift(k) for k in range(2000))
+    assert len(merged) == 2999
+    assert_almost_equal(merged.count(1000, 1001), 10)
+    assert_almost_equal(merged.count(), 20000)
+
+
+def test_add_many():
+    f = make_density()
+    g = PiecewiseDensity()
+    g.add([Segment(0, 4, 8), Segment(2, 6, 4)])
+    g.add([PiecewiseDensity.merge([Segment(3, 3, 5)]), Segment(8, 10, 1)])
+    assert g[:] == f[:]
+
+
+def test_index_is_invalidated_by_add():
+    f = make_density()
+    assert f.count() == 18
+    assert f.icount(17) == 6
+    f.add(Segment(10, 12, 2))
+    assert f.count() == 20
+    assert f.count(9, None) == 2.5
+    assert f.icount(19) == 11
+    assert_almost_equal(f.mean(10, None), 11)
+
+
+def test_batch_queries():
+    f = make_density()
+    a = np.array([[-1, 0, 2.5], [3, 3.5, 9]])
+    b = np.array([[1, 4, 3], [3, 11, 11]])
+    counts = f.count_many(a, b)
+    assert counts.shape == (2, 3)
+    for i in range(2):
+        for j in range(3):
+            assert_almost_equal(counts[i, j], f.count(a[i, j], b[i, j]))
+            assert_almost_equal(f.sum_many(a, b)[i, j], f.sum(a[i, j], b[i, j]))
+            assert_almost_equal(f.mean_many(a, b)[i, j], f.mean(a[i, j], b[i, j]))
+
+    assert_almost_equal(f.count_many(a).ravel(), [f.count(x) for x in a.ravel()])
+    assert_almost_equal(f.count_many(None, 3), f.count(None, 3))
+    assert np.isnan(f.mean_many([11, 12], None)).all()
+
+    n = np.array([-1, 0, 2, 8, 12, 13.5, 100])
+    assert list(f.icount_many(n)) == [f.icount(x) for x in n]
+    assert list(f.icount_many(n, left=-5, right=20)) == [-5, 0, 1, 3, 3, 3.5, 20]
+
+    x = np.linspace(0, 9, 10)
+    assert_almost_equal(f.tail_ratio_curve(x[1:]), [f.tail_ratio(v) for v in x[1:]])
+    assert_almost_equal(f.pareto_curve(x), [f.pareto(v) for v in x])
+
+
+def test_empty_queries():
+    f = PiecewiseDensity()
+    assert f.count() == 0
+    assert f.count(1, 2) == 0
+    assert np.isnan(f.mean())
+    assert f.icount(1) is None
+    assert f.count_many([1, 2]).shape == (2,)
+
+
+def test_uniform_sample():
+    f = make_density()
+    k = 37
+    step = f.count() / k
+    expected = [f.icount((i + 0.5) * step) for i in range(k)]
+    assert_almost_equal(f.uniform_sample(k), expected)
+
+    s = f.uniform_sample(10, leftpad=36, left=-1)
+    assert list(s[:5]) == [-1] * 5
+    assert_almost_equal(s[5:], f.uniform_sample(5))
+
+    blocks = list(f.iter_uniform_sample(k, leftpad=20, left=-1, chunk_size=10))
+    assert [len(block) for block in blocks] == [10, 10, 10, 7]
+    assert list(np.concatenate(blocks)) == list(
+        f.uniform_sample(k, leftpad=20, left=-1)
+    )
+
+
+def test_random_sample():
+    f = make_density()
+    s = f.random_sample(1000, rng=5)
+    assert s.shape == (1000,)
+    assert np.all((s >= 0) & (s <= 10))
+    assert list(s) == list(f.random_sample(1000, rng=np.random.default_rng(5)))
+
+    blocks = list(f.iter_random_sample(25, rng=5, chunk_size=10))
+    assert [len(block) for block in blocks] == [10, 10, 5]
+    assert list(np.concatenate(blocks)) == list(f.random_sample(25, rng=5))
+
+
+def test_compress():
+    x = np.linspace(0, 10, 101)
+    n = np.concatenate([np.full(50, 1.0), np.full(50, 1.0 + 1e-3)])
+    f = PiecewiseDensity.merge(
+        [PiecewiseDensity.from_arrays(x[:-1], x[1:], n), Segment(20, 20, 3)]
+    )
+    g, err = f.compress(0.01)
+    assert len(g) == 3
+    assert g[-1] == Segment(20, 20, 3)
+    assert_almost_equal(g.count(), f.count())
+    assert_almost_equal(g.sum(), f.sum())
+    assert err < 0.1
+    bounds = np.linspace(-1, 21, 45)
+    assert (
+        np.max(np.abs(g.count_many(None, bounds) - f.count_many(None, bounds))) <= err
+    )
+
+    g, err = f.compress(1e-6)
+    assert len(g) == 5
+    assert_almost_equal(g.sum(), f.sum())
+
+    g, err = make_density().compress(0.0)
+    assert g[:] == make_density()[:]
+    assert err == 0.0
+    assert PiecewiseDensity().compress(0.1)[0].empty
+
+    f = PiecewiseDensity.from_arrays([0, 1, 2, 3], [1, 2, 3, 4], [0, 0, 0, 5])
+    g, err = f.compress(0.1)
+    assert g[:] == f[:]
+    assert err == 0.0
+
+    f = PiecewiseDensity.from_arrays([0, 1, 2], [1, 2, 3], [-1, -1.01, -1.02])
+    g, err = f.compress(0.1)
+    assert len(g) == 2
+    assert_almost_equal(g.count(), -3.03)
+    assert_almost_equal(g.sum(), f.sum())
+
+
+def test_rebin():
+    f = make_density()
+    g, err = f.rebin([0, 5, 10])
+    assert_almost_equal(g.count(0, 5), f.count(0, 5))
+    assert_almost_equal(g.count(5, 11), f.count(5, 11))
+    assert_almost_equal(g.sum(0, 5), f.sum(0, 5))
+    assert_almost_equal(g.sum(), f.sum())
+    assert g.xmin >= 0 and g.xmax <= 10
+    x = np.linspace(-1, 11, 49)
+    assert np.max(np.abs(g.count_many(None, x) - f.count_many(None, x))) <= err + 1e-12
+
+    with pytest.raises(ValueError):
+        f.rebin([3, 4, 10.5])
+
+    g, _ = PiecewiseDensity.merge([Segment(1, 1, 2)]).rebin([1, 2])
+    assert g[:] == [Segment(1, 1, 2)]
+
+    g, _ = (-f).rebin([0, 5, 10])
+    assert_almost_equal(g.count(0, 5), -f.count(0, 5))
+    assert_almost_equal(g.sum(), -f.sum())
+
+    with pytest.raises(ValueError):
+        PiecewiseDensity.from_arrays([0, 1], [1, 2], [-1, 2]).rebin([0, 2])
+
+
+def test_save_and_load(tmp_path):
+    f = make_density()
+    path = tmp_path / "f.vlpd"
+    f.save(path)
+    assert path.stat().st_size == 16 + 3 * 8 * len(f)
+
+    g = PiecewiseDensity.load(path)
+    assert g[:] == f[:]
+    base = g.va
+    while isinstance(base, np.ndarray):
+        base = base.base
+    assert isinstance(base, mmap.mmap)
+    assert not g.va.flags.writeable
+    assert g.count(1, 9) == f.count(1, 9)
+
+    g = PiecewiseDensity.load(path, mmap=False)
+    assert g[:] == f[:]
+
+    PiecewiseDensity().save(path)
+    assert PiecewiseDensity.load(path).empty
+
+    path.write_bytes(b"not a density")
+    with pytest.raises(ValueError):
+        PiecewiseDensity.load(path)
+
+
+def test_arithmetic():
+    f = make_density()
+    g = PiecewiseDensity.merge([Segment(1, 9, 4), Segment(3, 3, 1)])
+
+    h = f + g
+    assert_almost_equal(h.count(), f.count() + g.count())
+    assert_almost_equal(h.sum(2, 5), f.sum(2, 5) + g.sum(2, 5))
+    assert sum([f, g])[:] == h[:]
+    assert (f + Segment(3, 3, 1))[2] == Segment(3, 3, 6)
+    assert (f - Segment(3, 3, 1))[2] == Segment(3, 3, 4)
+    with pytest.raises(TypeError):
+        Segment(0, 1, 2) * 2
+
+    d = h - g
+    for a, b in [(0, 2.5), (3, 3), (2.5, 7), (None, None)]:
+        assert_almost_equal(d.count(a, b), f.count(a, b))
+        assert_almost_equal(d.sum(a, b), f.sum(a, b))
+    assert_almost_equal((f - f).count_many([0, 3, 5], None), [0, 0, 0])
+
+    m = 2 * f
+    assert np.shares_memory(m.va, f.va)
+    assert m[:] == [Segment(s.a, s.b, 2 * s.n) for s in f[:]]
+    assert (f * 0.5)[0] == Segment(0, 2, 2)
+    assert (-f).count() == -f.count()
+
+    s = f.shift(10)
+    assert s[0] == Segment(10, 12, 4)
+    assert_almost_equal(s.mean(), f.mean() + 10)
+
+    r = f.scale_x(1.5)
+    assert r[2] == Segment(4.5, 4.5, 5)
+    assert r.count() == f.count()
+    assert_almost_equal(r.mean(), 1.5 * f.mean())
+    assert_almost_equal(r.vh[0], f.vh[0] / 1.5)
@@ -0,0 +1,124 @@
+import numpy as np
+from numpy.testing import assert_allclose, assert_almost_equal
+
+from verolysis.piecewise_density_batch_optimizer import (
+    PiecewiseDensityBatchOptimizer,
+    _BatchFringeCondition,
+)
+from verolysis.piecewise_density_optimizer import PiecewiseDensityOptimizer
+
+
+FRACTILES = np.array([0.25, 0.75, 0.10, 0.20, 0.30, 0.40, 0.50, 0.60, 0.70, 0.80, 0.90])
+NAN = np.nan
+
+ROWS = [
+    # Case b: one-parameter problem
+    (
+        4_777_805,
+        31_781,
+        [14_569, 41_707, 7_624, 12_151, 16_700, 21_503, 26_755, 32_222]
+        + [38_199, 45_982, 59_444],
+    ),
+    # Case c: three-parameter problem
+    (
+        256_083,
+        22_398,
+        [20_128, 27_894, 7_535, 17_195, 22_436, 24_898, 25_832, 26_683]
+        + [27_498, 28_284, 29_076],
+    ),
+    # Case d: repeated values
+    (
+        12_253,
+        999,
+        [195, 1_320, 80, 135, 281, 513, 895, 1_320, 1_320, 1_320, 2_203],
+    ),
+    # Quartiles only
+    (100, 0.5, [0.25, 0.75] + [NAN] * 4 + [0.5] + [NAN] * 4),
+]
+
+
+def scalar_density(N, mean, values):
+    opt = PiecewiseDensityOptimizer(N, mean, 0.0)
+    for value, fractile in zip(values, FRACTILES):
+        if np.isfinite(value):
+            opt.add(value, fractile)
+    assert opt.optimize().success
+    return opt.build()
+
+
+def test_batch_matches_scalar():
+    N = np.array([row[0] for row in ROWS], dtype=float)
+    mean = np.array([row[1] for row in ROWS], dtype=float)
+    values = np.array([row[2] for row in ROWS], dtype=float)
+
+    opt = PiecewiseDensityBatchOptimizer(N, mean, values, FRACTILES, 0.0)
+    success = opt.optimize()
+    assert success.all()
+    assert opt.converged.all()
+    assert len(opt.x(1)) == 3
+
+    for i, (n, m, v) in enumerate(ROWS):
+        f = opt.build(i)
+        ref = scalar_density(n, m, v)
+        assert_almost_equal(f.count(), n, decimal=2)
+        assert_almost_equal(f.sum(), n * m, decimal=2)
+        assert_almost_equal(f.xmax, ref.xmax, decimal=2)
+        if i == 1:
+            # The scalar fit of case c leaves a sliver of width 6e-5 at 0,
+            # where the batch fit puts the same count as a point mass
+            assert_almost_equal(f.count(0, 0), ref.count(0, 1e-3), decimal=1)
+            x = np.linspace(1e-3, 40_000, 101)
+            assert_allclose(f.count_many(None, x), ref.count_many(None, x), 1e-5)
+        else:
+            assert len(f) == len(ref)
+            assert list(f.va[1:]) == list(ref.va[1:])
+            assert list(f.vb[:-1]) == list(ref.vb[:-1])
+            assert_almost_equal(f.xmin, ref.xmin, decimal=2)
+
+
+def test_unconverged_rows_fall_back(monkeypatch):
+    N = np.array([row[0] for row in ROWS], dtype=float)
+    mean = np.array([row[1] for row in ROWS], dtype=float)
+    values = np.array([row[2] for row in ROWS], dtype=float)
+    opt = PiecewiseDensityBatchOptimizer(N, mean, values, FRACTILES, 0.0)
+
+    # A second, lower minimum at the right end of the first bracket
+    cls = _BatchFringeCondition
+    hi = cls(opt).bracket1()[1][0]
+    score1 = cls.score1
+    monkeypatch.setattr(
+        cls, "score1", lambda self, a: np.where(a == hi, -1.0, score1(self, a))
+    )
+    assert opt.optimize().all()
+    assert list(opt.converged) == [False, True, True, True]
+    assert_almost_equal(opt.build(0).sum(), N[0] * mean[0], decimal=2)
+
+
+def test_three_parameter_rows():
+    # Case c, and a bunched bracket that takes trust-constr over 1000 steps
+    bunched = [NAN] * 11
+    for value, fractile in [(1.0, 0.25), (1.1, 0.5), (1.2, 0.75), (0.9, 0.1)]:
+        bunched[list(FRACTILES).index(fractile)] = value * 1e4
+    rows = [ROWS[1], (279_305, 0.97e4, bunched)]
+    N = np.array([row[0] for row in rows], dtype=float)
+    mean = np.array([row[1] for row in rows], dtype=float)
+    values = np.array([row[2] for row in rows], dtype=float)
+
+    opt = PiecewiseDensityBatchOptimizer(N, mean, values, FRACTILES, 0.0)
+    assert opt.optimize().all()
+    assert opt.converged.all()
+    for i, (n, m, v) in enumerate(rows):
+        ref = PiecewiseDensityOptimizer(n, m, 0.0)
+        for value, fractile in zip(v, FRACTILES):
+            if np.isfinite(value):
+                ref.add(value, fractile)
+        fun = ref.optimize().fun
+        assert ref._score3(opt.x(i)) <= fun + 1e-9
+        f, g = opt.build(i), ref.build()
+        assert_almost_equal(f.count() / g.count(), 1.0)
+        assert_almost_equal(f.sum() / g.sum(), 1.0)
+
+    # Rows that do not converge still fall back
+    opt = PiecewiseDensityBatchOptimizer(N, mean, values, FRACTILES, 0.0, gtol=0.0)
+    assert opt.optimize().all()
+    assert not opt.converged.any()
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from verolysis.piecewise_density import Segment
+from verolysis.piecewise_density_builder import PiecewiseDensityBuilder
+
+
+def test_add_and_add_many():
+    builder = PiecewiseDensityBuilder()
+    builder.add(0, 0.0)
+    builder.add(24, 0.1)
+    builder.add_many([25, 50], [1.0, 1.1])
+    builder.add_many(np.array([75, 100]), np.array([1.2, 1.21]))
+    f = builder.build()
+    assert len(f) == 5
+    assert f[0] == Segment(0.0, 0.1, 24)
+    assert f[2] == Segment(1.0, 1.1, 25)
+    assert f[-1] == Segment(1.2, 1.21, 25)
+    assert f.count() == 100
+
+    assert PiecewiseDensityBuilder().build().empty
+    builder = PiecewiseDensityBuilder()
+    builder.add(1, 1.0)
+    assert builder.build().empty
+
+
+def test_steps_must_increase():
+    builder = PiecewiseDensityBuilder()
+    with pytest.raises(AssertionError):
+        builder.add_many([0, 2, 1], [0, 1, 2])
+    builder.add_many([0, 1], [0, 1])
+    with pytest.raises(AssertionError):
+        builder.add(2, 1)
+    with pytest.raises(AssertionError):
+        builder.add(1, 2)
+    builder.add(2, 2)
+    assert builder.build().count() == 2
@@ -1,6 +1,10 @@
+from verolysis.piecewise_density import PiecewiseDensity
 from verolysis.piecewise_density_builder import PiecewiseDensityBuilder
 from verolysis.piecewise_density_optimizer import PiecewiseDensityOptimizer
 from numpy.testing import assert_almost_equal
+import numpy as np
+import scipy
+import warnings
 
 
 def assert_segments_are_sane(segments):
@@ -90,15 +94,15 @@ def test_case_a():
     assert o.success
 
     f = opt.build()
-    assert len(f._segments) == 4
-    assert_segments_are_sane(f._segments)
-
-    assert f._segments[0].b == p25
-    assert f._segments[1].a == p25
-    assert f._segments[1].b == p50
-    assert f._segments[2].a == p50
-    assert f._segments[2].b == p75
-    assert f._segments[3].a == p75
+    assert len(f) == 4
+    assert_segments_are_sane(f)
+
+    assert f[0].b == p25
+    assert f[1].a == p25
+    assert f[1].b == p50
+    assert f[2].a == p50
+    assert f[2].b == p75
+    assert f[3].a == p75
     assert_almost_equal(f.count(), N, decimal=2)
     assert_almost_equal(f.sum(), N * m, decimal=2)
 
@@ -120,14 +124,14 @@ def test_case_b():
     assert o.success
 
     f = opt.build()
-    assert len(f._segments) == 12
-    assert_segments_are_sane(f._segments)
-
-    assert f._segments[0].b == 7_624
-    assert f._segments[11].a == 59_444
-    assert f._segments[0].a >= 0
-    assert f._segments[0].a < 7_624
-    assert f._segments[11].b > 59_444
+    assert len(f) == 12
+    assert_segments_are_sane(f)
+
+    assert f[0].b == 7_624
+    assert f[11].a == 59_444
+    assert f[0].a >= 0
+    assert f[0].a < 7_624
+    assert f[11].b > 59_444
     assert_almost_equal(f.count(), 4_777_805, decimal=2)
     assert_almost_equal(f.sum(), 4_777_805 * 31_781, decimal=2)
 
@@ -149,14 +153,14 @@ def test_case_c():
     assert o.success
 
     f = opt.build()
-    assert len(f._segments) == 13
-    assert_segments_are_sane(f._segments)
-
-    assert f._segments[1].b == 7_535
-    assert f._segments[12].a == 29_076
-    assert f._segments[1].a >= 0
-    assert f._segments[1].a < 7_535
-    assert f._segments[12].b > 29_076
+    assert len(f) == 13
+    assert_segments_are_sane(f)
+
+    assert f[1].b == 7_535
+    assert f[12].a == 29_076
+    assert f[1].a >= 0
+    assert f[1].a < 7_535
+    assert f[12].b > 29_076
     assert_almost_equal(f.count(), 256_083, decimal=2)
     assert_almost_equal(f.sum(), 256_083 * 22_398, decimal=2)
 
@@ -178,14 +182,112 @@ def test_case_d():
     assert o.success
 
     f = opt.build()
-    assert len(f._segments) == 10
-    assert_segments_are_sane(f._segments)
-
-    print(f._segments)
-    assert f._segments[0].b == 80
-    assert f._segments[-1].a == 2_203
-    assert f._segments[0].a >= 0
-    assert f._segments[0].a <= 80
-    assert f._segments[-1].b >= 2_203
+    assert len(f) == 10
+    assert_segments_are_sane(f)
+
+    print(f[:])
+    assert f[0].b == 80
+    assert f[-1].a == 2_203
+    assert f[0].a >= 0
+    assert f[0].a <= 80
+    assert f[-1].b >= 2_203
     assert_almost_equal(f.count(), 12_253, decimal=2)
     assert_almost_equal(f.sum(), 12_253 * 999, decimal=2)
+
+
+def test_analytic_derivatives():
+    opt = PiecewiseDensityOptimizer(256_083, 22_398, 0.0)
+    opt.add(7_535, 0.10)
+    opt.add(17_195, 0.20)
+    opt.add(22_436, 0.30)
+    opt.add(25_832, 0.50)
+    opt.add(29_076, 0.90)
+
+    for x in ([3_000.0], [7_000.0], [2_000.0, 500.0, 3_000.0], [6_000.0, 0.0, 10.0]):
+        x = np.array(x)
+        eps = 1e-4 * np.maximum(np.abs(x), 1.0)
+        jac = scipy.optimize.approx_fprime(x, opt._score, eps)
+        hess = scipy.optimize.approx_fprime(x, opt._jac, eps)
+        assert np.allclose(opt._jac(x), jac, rtol=1e-3, atol=1e-9)
+        assert np.allclose(opt._hess(x), hess, rtol=1e-3, atol=1e-9)
+
+
+def test_one_parameter_fast_path():
+    opt = PiecewiseDensityOptimizer(4_777_805, 31_781, 0.0)
+    opt.add(7_624, 0.10)
+    opt.add(26_755, 0.50)
+    opt.add(59_444, 0.90)
+    fr = opt._require_fringe_condition()
+    assert fr.left_coeff >= 0.5
+
+    lo, hi = fr.bracket1()
+    assert fr.amin <= lo <= hi <= fr.amax
+    o = opt.optimize()
+    assert o.success
+    assert o.x.shape == (1,)
+    assert lo <= o.x[0] <= hi
+
+    reference = scipy.optimize.minimize(
+        opt._score, fr.init1(), method="trust-constr", bounds=fr.bounds1()
+    )
+    assert o.fun <= reference.fun + 1e-9
+
+
+def test_warm_start():
+    def make(scale):
+        opt = PiecewiseDensityOptimizer(279_305, 0.97e4 * scale, 0.0)
+        for value, fractile in [(1.0, 0.25), (1.1, 0.5), (1.2, 0.75), (0.9, 0.1)]:
+            opt.add(value * 1e4 * scale, fractile)
+        return opt
+
+    first = make(1.0).optimize()
+    assert len(first.x) == 3
+    assert not first.warm_start
+
+    cold_opt = make(1.05)
+    cold = cold_opt.optimize()
+    warm_opt = make(1.05)
+    warm = warm_opt.optimize(first.hint)
+    assert warm.success and warm.warm_start
+    assert warm.nit < cold.nit / 4
+    assert_almost_equal(warm.fun, cold.fun, decimal=4)
+    f, g = cold_opt.build(), warm_opt.build()
+    assert_almost_equal(g.count(), f.count(), decimal=2)
+    assert_almost_equal(g.sum() / f.sum(), 1.0)
+
+    # One-parameter problems ignore the hint
+    opt = PiecewiseDensityOptimizer(100, 0.0)
+    opt.add(-1, 0.25)
+    opt.add(1, 0.75)
+    o = opt.optimize(np.array([0.5]))
+    assert o.success and not o.warm_start
+
+
+def test_warm_start_zero_width_fringe():
+    def make():
+        opt = PiecewiseDensityOptimizer(100, 1.0, 0.0)
+        for value, fractile in [(1.0, 0.25), (1.0, 0.5), (1.2, 0.75)]:
+            opt.add(value, fractile)
+        return opt
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        first = make().optimize()
+        assert not np.all(np.isfinite(first.hint))
+        again = make().optimize(first.hint)
+    assert again.success and not again.warm_start
+
+
+def test_build_matches_merge():
+    for amin, places in [
+        (-np.inf, [(-1, 0.25), (0, 0.5), (1, 0.75)]),
+        (0.0, [(1.0, 0.25), (1.1, 0.5), (1.2, 0.75)]),
+        (0.0, [(1.0, 0.25), (1.0, 0.5), (1.2, 0.75)]),
+    ]:
+        opt = PiecewiseDensityOptimizer(100, 1.0 if amin == 0 else 0.0, amin)
+        for value, fractile in places:
+            opt.add(value, fractile)
+        assert opt.optimize().success
+        f = opt.build()
+        ref = PiecewiseDensity.merge(opt._segments(opt._full_places()))
+        assert f[:] == ref[:]
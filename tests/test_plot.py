@@ -0,0 +1,80 @@
+import matplotlib
+
+matplotlib.use("Agg")
+
+import numpy as np
+from matplotlib import pyplot as plt
+from numpy.testing import assert_almost_equal
+
+from verolysis import plot
+from verolysis.piecewise_density import PiecewiseDensity, Segment
+
+
+def make_density(k=10_000):
+    x = np.linspace(0, 100, k + 1)
+    n = np.random.default_rng(0).random(k)
+    return PiecewiseDensity.merge(
+        [PiecewiseDensity.from_arrays(x[:-1], x[1:], n), Segment(50, 50, 5)]
+    )
+
+
+def test_stairs_exact():
+    f = PiecewiseDensity.merge([Segment(0, 2, 4), Segment(3, 4, 1), Segment(3, 3, 9)])
+    edges, heights = plot._stairs(f, 0, 10, 100)
+    assert list(edges) == [0, 2, 3, 4, 10]
+    assert list(heights) == [2, 0, 1, 0]
+
+    edges, heights = plot._stairs(f, 1, 3.5, 100)
+    assert list(edges) == [1, 2, 3, 3.5]
+    assert list(heights) == [2, 0, 1]
+
+
+def test_stairs_downsampled():
+    f = make_density()
+    edges, heights = plot._stairs(f, 10, 60, 200)
+    assert len(edges) == 201
+    assert_almost_equal(np.sum(heights * np.diff(edges)), f.count(10, 60) - 5)
+
+
+def test_guess_height():
+    f = make_density()
+    h = np.sort(f.vh[np.isfinite(f.vh)])
+    assert plot._guess_height(f) == h[-10] * 1.1
+    assert plot._guess_height(PiecewiseDensity()) is None
+
+
+def test_plot_density():
+    f = make_density()
+    fig, ax = plt.subplots()
+    plot.plot_density(f, ax=ax, xmax=80)
+    assert len(ax.patches) == 1
+    assert ax.get_xlim() == (0, 80)
+
+    fig, ax = plt.subplots()
+    plot.plot_density(PiecewiseDensity.merge(f[:50]), ax=ax, style="bar")
+    assert len(ax.patches) == 50
+    plt.close("all")
+
+
+def test_plot_grid(tmp_path):
+    densities = {
+        (year, group): make_density(100 * (k + 1)).shift(year - 2020)
+        for k, group in enumerate(["A", "B"])
+        for year in [2020, 2021, 2022]
+    }
+    densities[(2022, "B")] = PiecewiseDensity()
+    path = tmp_path / "grid.png"
+    fig = plot.plot_grid(densities, path, figsize=(9, 4), xmax=90)
+    assert path.stat().st_size > 0
+    assert len(fig.axes) == 6
+    assert fig.axes[0].get_title() == "2020"
+    assert fig.axes[3].get_ylabel() == "B"
+    assert fig.axes[5].get_xlim() == (0, 90)
+    assert fig.axes[4].xaxis.get_major_formatter()(2_000, 0) == "2k"
+    assert len(fig.axes[5].patches) == 0
+
+    again = plot.plot_grid(densities, fig=fig, xmax=90)
+    assert again is fig
+    assert len(fig.axes) == 6
+    assert [len(ax.patches) for ax in fig.axes] == [1, 1, 1, 1, 1, 0]
+    plt.close("all")
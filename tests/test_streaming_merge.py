@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+from verolysis import income_brackets
+from verolysis.piecewise_density import PiecewiseDensity, Segment
+from verolysis.streaming_merge import (
+    ArraySink,
+    FileSink,
+    StreamingMerger,
+    stream_merge,
+)
+
+from test_income_brackets import make_table
+
+
+def make_parts(k=200, seed=0):
+    rng = np.random.default_rng(seed)
+    parts = []
+    for _ in range(k):
+        x = np.sort(rng.integers(0, 1_000, 6)).astype(float)
+        f = PiecewiseDensity.merge(
+            [Segment(a, b, float(rng.integers(1, 10))) for a, b in zip(x, x[1:])]
+        )
+        parts.append(f)
+    return parts
+
+
+def assert_same(f, g):
+    assert list(f.va) == list(g.va)
+    assert list(f.vb) == list(g.vb)
+    assert_allclose(f.vn, g.vn, rtol=1e-9, atol=1e-9)
+
+
+@pytest.mark.parametrize("buffer_segments", [10, 100, 10_000])
+def test_unordered(buffer_segments):
+    parts = make_parts()
+    sink = ArraySink()
+    with StreamingMerger(sink, buffer_segments=buffer_segments) as merger:
+        for f in parts:
+            merger.add(f)
+    assert_same(sink.density(), PiecewiseDensity.merge(parts))
+
+    sink = ArraySink()
+    with pytest.raises(KeyError):
+        with StreamingMerger(sink, buffer_segments=buffer_segments) as merger:
+            for f in parts:
+                merger.add(f)
+            raise KeyError
+    merger.close()
+    assert sink.density().empty
+
+
+@pytest.mark.parametrize("buffer_segments", [10, 10_000])
+def test_ordered(buffer_segments):
+    parts = sorted(make_parts(), key=lambda f: f.xmin)
+    sink = ArraySink()
+    with StreamingMerger(sink, True, buffer_segments) as merger:
+        for f in parts:
+            merger.add(f)
+    assert_same(sink.density(), PiecewiseDensity.merge(parts))
+    if buffer_segments == 10:
+        assert len(sink._chunks) > 10
+
+    merger = StreamingMerger(ArraySink(), ordered=True)
+    merger.add(parts[-1])
+    with pytest.raises(AssertionError):
+        merger.add(parts[0])
+
+
+def test_stream_merge_and_file_sink(tmp_path):
+    parts = make_parts(seed=1)
+    chunks = list(stream_merge(parts, buffer_segments=50))
+    assert len(chunks) > 1
+    g = PiecewiseDensity.from_arrays(*(np.concatenate(v) for v in zip(*chunks)))
+    assert_same(g, PiecewiseDensity.merge(parts))
+
+    path = tmp_path / "merged.vlpd"
+    sink = FileSink(path)
+    with StreamingMerger(sink, buffer_segments=50) as merger:
+        for f in parts:
+            merger.add(f)
+    sink.close()
+    assert_same(PiecewiseDensity.load(path), g)
+    assert [p.name for p in tmp_path.iterdir()] == ["merged.vlpd"]
+
+
+def test_stream_density():
+    df = make_table()
+    sink = ArraySink()
+    income_brackets.stream_density(df, sink, buffer_segments=20)
+    assert_same(sink.density(), income_brackets.to_density(df))